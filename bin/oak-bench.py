@@ -0,0 +1,9 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+from oak.benchmark import Benchmark
+
+if __name__ == '__main__':
+    benchmark = Benchmark()
+    benchmark.run(sys.argv[1:])
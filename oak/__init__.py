@@ -8,19 +8,65 @@
 
 """
 
-import codecs
+import contextlib
+import datetime
 import glob
+import itertools
+import json
+import multiprocessing
 import os
 import shutil
 import sys
+import threading
+import time
 
-from jinja2 import Environment, FileSystemLoader
+from multiprocessing.pool import ThreadPool
 
-from oak.models.post import Post
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, TemplateNotFound
+
+from oak.models.post import Post, PostSummary
 from oak.models.tag import Tag
-from oak.models.author import Author
-from oak.utils import copytree_, Filters
+from oak.index import PostIndex, post_period
+from oak.utils import copytree_, fill_settings, makedirs_, write_if_changed, write_chunks_if_changed, Filters
+from oak.utils.cache import DiskCache, cache_key
 from oak.processors import processor
+from oak.manifest import Manifest, build_fingerprint, file_digest
+from oak.assets import Assets
+from oak.compress import precompress, remove_outdated
+from oak.metrics import Metrics
+from oak.writer import Writer
+from oak.search import DOCS_NAME, SEARCH_VERSION, STOPWORDS, SearchIndex, post_terms
+from oak.related import post_features, related
+from oak.vcs import VCSError, changed_since
+from oak import profiler
+
+# The Oak instance a post rendering worker process belongs to, see _init_worker
+_worker_oak = None
+
+# Held while forking the post rendering workers, see Oak._render_posts
+_fork_lock = threading.Lock()
+
+def _render_post(f):
+    """Renders a post inside a worker process
+
+    :returns: the post, the changes to the worker's stats and the post's timings
+    """
+    before = _worker_oak.stats.copy()
+    post = _worker_oak._render_post(f)
+    stats = dict((k, v - before[k]) for k, v in _worker_oak.stats.items())
+    return post, stats, profiler.get_active().post_timings(f)
+
+def _init_worker(my_oak):
+    """Sets up a post rendering worker process of `my_oak`, the instance
+    it was forked from
+    """
+    global _worker_oak
+    _worker_oak = my_oak
+    my_oak._activate()
+    # events are sent by the parent process, see Oak._render_posts
+    my_oak.metrics.subscribers = []
+    # the writer thread isn't forked, workers write their posts themselves
+    my_oak.writer = None
 
 class Oak(object):
     """The main Oak class
@@ -29,10 +75,20 @@ class Oak(object):
 
     logger = None
     settings = None
-    posts = []
-    authors = {}
-    tags = {}
+    index = None
     blog_url = None
+    manifest = None
+    profiler = None
+    changed_sources = None
+    stats = None
+    metrics = None
+    highlight_cache = None
+    html_cache = None
+    templates = None
+    date_archives = None
+    assets = None
+    page_pool = None
+    writer = None
 
     def __init__(self, logger=None, settings=None):
         """Initializes the class
@@ -48,7 +104,7 @@ class Oak(object):
         if logger:
             self.logger = logger
         if settings:
-            self.settings = settings
+            self.settings = fill_settings(settings)
 
         if self.settings.BLOG_PREFIX:
             self.blog_url = "http://%s/%s" % (self.settings.BLOG_DOMAIN, self.settings.BLOG_PREFIX)
@@ -56,15 +112,37 @@ class Oak(object):
             self.blog_url = "http://%s" % (self.settings.BLOG_DOMAIN,)
 
         self.logger.info("Starting up...")
+        # the state of a generation belongs to this instance alone
+        self.posts = []
+        self.sources = {}
+        self.related = {}
+        self.headers = {}
+        self.tags = {}
+        self.authors = {}
+        self.page_results = []
+        self.metrics = Metrics()
         # set up the Jinja environment
         # get the filters
-        self.jenv = Environment(loader=FileSystemLoader(os.path.sep.join([self.settings.LAYOUTS_PATH, self.settings.DEFAULT_LAYOUT])),extensions=['jinja2.ext.i18n'])
+        bytecode_cache = None
+        if self.settings.TEMPLATE_CACHE:
+            # compiled templates survive the process, the sources are still
+            # checked so edited templates are compiled again
+            makedirs_(self._template_cache_path())
+            bytecode_cache = FileSystemBytecodeCache(self._template_cache_path())
+        self.jenv = Environment(loader=FileSystemLoader(os.path.sep.join([self.settings.LAYOUTS_PATH, self.settings.DEFAULT_LAYOUT])),extensions=['jinja2.ext.i18n'],bytecode_cache=bytecode_cache)
 
         self.jenv.filters['datetimeformat'] = Filters.datetimeformat
         self.jenv.filters['longdate'] = Filters.longdate
         self.jenv.filters['shortdate'] = Filters.shortdate
         self.jenv.filters['isodate'] = Filters.isodate
+        self.jenv.globals['asset'] = self._asset_url
         self.logger.debug("Template environment ready.")
+        if self.settings.HIGHLIGHT_CACHE:
+            self.highlight_cache = DiskCache(os.path.sep.join([self.settings.CACHE_PATH, 'highlight']), self.settings.HIGHLIGHT_CACHE_SIZE)
+        if self.settings.HTML_CACHE:
+            self.html_cache = DiskCache(os.path.sep.join([self.settings.CACHE_PATH, 'html']), self.settings.HTML_CACHE_SIZE)
+        # the variables every page gets, see _context. They're set up before
+        # any page is rendered and only read from then on
         self.tpl_vars = {
             'blog': {
                 'title': self.settings.BLOG_TITLE,
@@ -84,6 +162,8 @@ class Oak(object):
                 'css': os.path.sep.join([self.blog_url, self.settings.HTMLS['css']]),
             }
         }
+        if self.settings.GENERATE_SEARCH_INDEX:
+            self.tpl_vars['links']['search'] = os.path.sep.join([self.blog_url, self.settings.SEARCH_PATH])
 
     def _author_path(self, authorname=None):
         """Calculates the final path for a author page given a author name
@@ -163,8 +243,240 @@ class Oak(object):
         """
         return os.path.sep.join([self.settings.OUTPUT_PATH, self.settings.HTMLS['archive']])
 
+    def _search_path(self, name=None):
+        """Calculates the PATH of a file of the search index
+
+        :param name: the name of the file. If None, return just the directory of the index
+
+        :returns: string
+        """
+        if name:
+            return os.path.sep.join([self.settings.OUTPUT_PATH, self.settings.SEARCH_PATH, name])
+        return os.path.sep.join([self.settings.OUTPUT_PATH, self.settings.SEARCH_PATH])
+
+    def _manifest_path(self):
+        """Calculates the PATH of the incremental build manifest
+
+        :returns: string
+        """
+        return os.path.sep.join([self.settings.CACHE_PATH, 'manifest.pickle'])
+
+    def _template_cache_path(self):
+        """Calculates the PATH of the compiled templates cache
+
+        :returns: string
+        """
+        return os.path.sep.join([self.settings.CACHE_PATH, 'jinja'])
+
+    def _template(self, kind):
+        """Returns the template for the pages of `kind`, one of the keys of
+        settings.TEMPLATES. Templates are loaded once per generation.
+
+        :returns: jinja2.Template
+        """
+        if kind not in self.templates:
+            self.templates[kind] = self.jenv.get_template(self.settings.TEMPLATES[kind])
+        return self.templates[kind]
+
+    def _has_template(self, kind):
+        """Tells whether the layout has the template for the pages of
+        `kind`, see _template
+
+        :returns: bool
+        """
+        try:
+            self._template(kind)
+        except TemplateNotFound:
+            return False
+        return True
+
+    def _date_archives(self):
+        """Tells whether to generate the year and month pages: layouts
+        made before they existed have no templates for them.
+
+        :returns: bool
+        """
+        if not self.settings.GENERATE_DATE_ARCHIVES:
+            return False
+        missing = [self.settings.TEMPLATES[kind] for kind in ('year', 'month') if not self._has_template(kind)]
+        if missing:
+            self.logger.warning("The layout has no %s, not generating the date archives.", ' nor '.join(missing))
+            return False
+        return True
+
+    def _render(self, kind, context):
+        """Renders the template for the pages of `kind` with `context`
+
+        :returns: string
+        """
+        with self.metrics.timer('render', kind=kind):
+            output = self._template(kind).render(context)
+        self.metrics.incr('pages', kind=kind)
+        return output
+
+    def _context(self, page_vars):
+        """Builds the template variables of a page: those shared by every
+        page plus its own `page_vars`, without changing the shared ones.
+
+        :param page_vars: the variables of the page
+        :type page_vars: dict
+
+        :returns: dict
+        """
+        context = dict(self.tpl_vars)
+        context.update(page_vars)
+        return context
+
+    def _render_page(self, kind, path, context, stream=False):
+        """Renders the page of `kind` with `context` and writes it to `path`
+
+        :param stream: whether to write the page while it's rendered
+            instead of rendering it all in memory first
+        """
+        if stream:
+            with self.metrics.timer('render', kind=kind):
+                self._write_stream(path, self._template(kind).generate(context))
+            self.metrics.incr('pages', kind=kind)
+        else:
+            self._write_file(path, self._render(kind, context))
+
+    def _page(self, kind, path, page_vars, stream=False):
+        """Renders a listing page (see _render_page) on the page pool, if
+        there's one, or right away otherwise. Pages rendered on the pool
+        are waited for by _wait_pages.
+
+        :param page_vars: the variables of the page, see _context
+        """
+        context = self._context(page_vars)
+        if self.page_pool is None:
+            self._render_page(kind, path, context, stream)
+            return
+        # load the template here, so threads don't compile it at once
+        self._template(kind)
+        self.page_results.append(self.page_pool.apply_async(self._render_page, (kind, path, context, stream)))
+
+    def _wait_pages(self):
+        """Waits for the pages rendered on the page pool, raising the
+        error of the first one which failed
+        """
+        results, self.page_results = self.page_results, []
+        for result in results:
+            result.get()
+
+    def _activate(self):
+        """Makes the profiler and the caches of this instance those of the
+        calling thread, see profiler.set_active and processor.use_caches.
+        Post rendering workers inherit them from the thread forking them.
+        """
+        profiler.set_active(self.profiler)
+        processor.use_caches(self.html_cache, self.highlight_cache)
+
+    @contextlib.contextmanager
+    def _phase(self, name):
+        """Profiles and times the generation phase `name`, use it as a
+        context manager
+        """
+        with profiler.get_active().phase(name):
+            with self.metrics.timer('phase', phase=name):
+                yield
+
+    def compile_layout(self):
+        """Compiles every template of the layout ahead of time, filling
+        the compiled templates cache.
+
+        :returns: the number of templates compiled
+        """
+        names = self.jenv.list_templates(extensions=['jinja'])
+        for name in names:
+            self.logger.debug("Compiling template %s", name)
+            self.jenv.get_template(name)
+        return len(names)
+
+    def _full_build(self):
+        """Tells whether every page has to be rendered, which is the case
+        unless a usable manifest from a previous build was loaded.
+
+        :returns: bool
+        """
+        return self.manifest is None or not self.manifest.loaded
+
+    def _is_fresh(self, source):
+        """Tells whether the post at `source` can be restored from the
+        manifest instead of being rendered again.
+
+        :returns: bool
+        """
+        if self._full_build():
+            return False
+        if self.changed_sources is not None and source in self.manifest.sources:
+            return os.path.abspath(source) not in self.changed_sources
+        return self.manifest.is_fresh(source)
+
+    def _needs_render(self, path, dirty=True):
+        """Tells whether the page at `path` has to be rendered
+
+        :param path: the output path of the page
+        :param dirty: whether the contents of the page may have changed
+        :type dirty: bool
+
+        :returns: bool
+        """
+        return dirty or self._full_build() or not os.path.exists(path)
+
+    def _mark_dirty(self, post):
+        """Marks the tag, author and date archive pages listing `post` as
+        outdated
+        """
+        self.changed = True
+        self.dirty_tags.update(post['metadata']['tags'])
+        self.dirty_authors.add(post['metadata']['author'])
+        period = post_period(post)
+        self.dirty_periods.update([period[:1], period])
+
+    def _remove_file(self, filename):
+        """Removes a generated file which is no longer part of the site
+        """
+        if os.path.exists(filename):
+            self.logger.info("Removing stale file %s", filename)
+            os.remove(filename)
+            try:
+                # drop the directory too if it's left empty
+                os.rmdir(os.path.dirname(filename))
+            except OSError:
+                pass
+
     def _archive_url(self):
         return os.path.sep.join([self.settings.HTMLS['archive']])
+
+    def _period_prefix(self, period):
+        """Calculates the list of path components of a date archive
+
+        :param period: (year,) or (year, month)
+        :type period: tuple
+
+        :returns: list
+        """
+        return ["%04d" % (period[0],)] + ["%02d" % (m,) for m in period[1:]]
+
+    def _period_path(self, period):
+        """Calculates the PATH of the archive page of a year or a month
+
+        :param period: (year,) or (year, month)
+        :type period: tuple
+
+        :returns: string
+        """
+        return os.path.sep.join([self.settings.OUTPUT_PATH] + self._period_prefix(period) + ['index.html'])
+
+    def _period_url(self, period):
+        """Calculates the URL of the archive page of a year or a month
+
+        :param period: (year,) or (year, month)
+        :type period: tuple
+
+        :returns: string
+        """
+        return os.path.sep.join(self._period_prefix(period) + ['index.html'])
         
     def _write_file(self, filename, content):
         """Writes content in filename.
@@ -176,153 +488,720 @@ class Oak(object):
         :type content: string
 
         """
-        self.logger.debug("Writing to file '%s'" % (filename,))
-        if filename.count(os.path.sep): # if it's a path, check for directories
-            if not os.path.exists(os.path.dirname(filename)):
-                os.makedirs(os.path.dirname(filename))
-        outfile = codecs.open(filename, mode='w', encoding='utf-8')
-        outfile.write(content)
-        outfile.close()
+        data = content.encode('utf-8')
+        if self.writer:
+            # see _written
+            self.writer.write(filename, data)
+        else:
+            self._written(filename, len(data), write_if_changed(filename, data))
+
+    def _written(self, filename, size, written):
+        """Counts a file passed to _write_file once it's written, or left
+        untouched as it didn't change
+
+        :param size: the length of the content in bytes
+        :param written: whether the file was written
+        """
+        if written:
+            self.logger.debug("Wrote file '%s'", filename)
+            self.metrics.incr('written', path=filename, bytes=size)
+            self.metrics.incr('bytes_written', size)
+        else:
+            self.logger.debug("File '%s' is unchanged, not written", filename)
+            self.metrics.incr('skipped', path=filename)
+
+    def _write_stream(self, filename, chunks):
+        """Writes the content produced by `chunks` in filename, as
+        _write_file does but without holding all of it in memory.
+
+        :param filename: the output file name
+        :type filename: string
+
+        :param chunks: an iterator over the pieces of the content
+        """
+        size = [0]
+        def encoded():
+            for c in chunks:
+                c = c.encode('utf-8')
+                size[0] += len(c)
+                yield c
+        if write_chunks_if_changed(filename, encoded()):
+            self.logger.debug("Wrote file '%s'", filename)
+            self.metrics.incr('written', path=filename, bytes=size[0])
+            self.metrics.incr('bytes_written', size[0])
+        else:
+            self.logger.debug("File '%s' is unchanged, not written", filename)
+            self.metrics.incr('skipped', path=filename)
 
     def _copy_statics(self):
         """Copies the satic files to the output static path.
 
         """
         static_path = os.path.sep.join([self.settings.OUTPUT_PATH, self.settings.STATIC_PATH])
-        self.logger.debug("Using '%s' as static_path" % (static_path),)
-        copytree_(self.settings.STATIC_PATH, static_path)
+        self.logger.debug("Using '%s' as static_path", static_path)
+        self._count_copies(copytree_(self.settings.STATIC_PATH, static_path))
         tpl_static = os.path.sep.join([self.settings.LAYOUTS_PATH, self.settings.DEFAULT_LAYOUT, self.settings.STATIC_PATH])
-        self.logger.debug("Using '%s' as template static path" % (tpl_static),)
+        self.logger.debug("Using '%s' as template static path", tpl_static)
         if os.path.exists(tpl_static) and os.path.isdir(tpl_static):
-            copytree_(tpl_static, static_path)
+            self._count_copies(copytree_(tpl_static, static_path))
+
+    def _asset_url(self, name):
+        """Calculates the URL of a static file, that of its fingerprinted
+        copy when there's one (see oak.assets)
+
+        :param name: the path of the file, relative to the static path
+        :type name: string
+
+        :returns: string
+        """
+        if self.assets:
+            name = self.assets.url(name)
+        return os.path.sep.join([self.blog_url, self.settings.STATIC_PATH, name])
+
+    def _do_assets(self):
+        """Writes the fingerprinted copies of the static files and points
+        links.css to that of the stylesheet.
+        """
+        static_path = os.path.sep.join([self.settings.OUTPUT_PATH, self.settings.STATIC_PATH])
+        self.assets = Assets(static_path, self.settings.ASSET_EXTENSIONS, self.settings.ASSET_MINIFY)
+        self.metrics.incr('copied', self.assets.run())
+        css = self.settings.HTMLS['css']
+        prefix = "%s/" % (self.settings.STATIC_PATH,)
+        if css.startswith(prefix):
+            self.tpl_vars['links']['css'] = self._asset_url(css[len(prefix):])
+
+    def _do_compress(self):
+        """Writes the compressed siblings of the generated files which
+        changed, see oak.compress. Without PRECOMPRESS, the siblings a
+        previous build wrote are removed once their files change.
+        """
+        if not self.settings.PRECOMPRESS:
+            removed = remove_outdated(self.settings.OUTPUT_PATH, self.settings.PRECOMPRESS_EXTENSIONS)
+            if removed:
+                self.logger.info("Removed %d outdated compressed files", removed)
+            return
+        written, removed = precompress(self.settings.OUTPUT_PATH, self.settings.PRECOMPRESS_EXTENSIONS,
+                                       max(self.settings.JOBS, multiprocessing.cpu_count()),
+                                       self.settings.PRECOMPRESS_BROTLI)
+        self.logger.info("Compressed %d files, removed %d outdated compressed files", written, removed)
+
+    def _count_copies(self, counts):
+        """Adds the counts returned by copytree_ to the build stats
+        """
+        copied, skipped = counts
+        self.metrics.incr('copied', copied)
+        self.metrics.incr('skipped', skipped)
 
     def _do_posts(self):
         """Do the posts generation.
         """
         self.logger.info("Rendering posts...")
-        self.logger.info("Using %s as source of content." % (self.settings.CONTENT_PATH,))
-        for f in glob.glob("%s/*.%s" % (self.settings.CONTENT_PATH,self.settings.SRC_EXT)):
-            self.logger.info("Processing %s..." % (f,))
-            post = Post(f, self.blog_url, self.settings, processor.MarkdownProcessor)
-            self.posts.append(post)
-            # cache the tags of the current post
-            for t in post['metadata']['tags']:
-                if t not in self.tags.keys():
-                    self.tags[t] = Tag(tag=t, settings=self.settings, posts=[post])
-                else:
-                    self.tags[t]['posts'].append(post)
-            # cache the author of the current post
-            author = post['metadata']['author']
-            if author not in self.authors.keys():
-                self.authors[author] = Author(author=author,url=self._author_url(author), posts=[post])
+        self.logger.info("Using %s as source of content.", self.settings.CONTENT_PATH)
+        sources = glob.glob("%s/*.%s" % (self.settings.CONTENT_PATH,self.settings.SRC_EXT))
+        if not self._full_build():
+            # drop the outputs of the posts whose source was removed
+            for f in self.manifest.removed(sources):
+                self.logger.info("Source %s was removed", f)
+                self._mark_dirty(self.manifest.get(f))
+                for output in self.manifest.forget(f)['outputs']:
+                    self._remove_file(output)
+        posts = {}
+        stale = []
+        for f in sources:
+            if self._is_fresh(f):
+                self.logger.debug("%s is unchanged, skipping", f)
+                posts[f] = self._restore_post(f, self.manifest.get(f))
             else:
-                self.authors[author]['posts'].append(post)
-            
+                stale.append(f)
+        if self.settings.RELATED_POSTS:
+            stale = self._find_related(sources, posts, stale)
+        for f, post in itertools.izip(stale, self._render_posts(stale)):
+            self.headers.pop(f, None)
+            if self.settings.LOW_MEMORY:
+                # the body was rendered already, keep just a summary
+                post = self._summarize_post(f, post)
+            posts[f] = post
+            if self.manifest:
+                old = self.manifest.get(f)
+                if old:
+                    self._mark_dirty(old)
+                self._mark_dirty(post)
+                self.manifest.record(f, post, [post['output_path']])
+        # keep the sources order so listings don't depend on what was rendered
+        self.index = PostIndex(self.settings, self._author_url, reverse=self.settings.POSTS_SORT_REVERSE)
+        for f in sources:
+            self.index.add(posts[f])
+        self.index.build()
+        self.sources = posts
+        self.posts = self.index.posts
+        self.tags = self.index.tags
+        self.authors = self.index.authors
+        # listing pages are rendered concurrently from now on, the shared
+        # variables must not change anymore
+        newest = self.index.newest()
+        self.tpl_vars['blog']['last_updated'] = newest['metadata']['pub_date'] if newest else None
+
+    def _find_related(self, sources, posts, stale):
+        """Finds the related posts of every post, see oak.related. Only the
+        headers of the posts to render are read, and kept in `headers` for
+        _render_post to go on with, and the restored posts whose related
+        posts changed are rendered again too. When no post changed, those
+        the restored posts have are kept.
+
+        Any change makes the related posts of every post computed again,
+        as a post may become related to any other; only the posts whose
+        related posts changed are rendered again though.
+
+        :param sources: the paths of every post file
+        :param posts: the restored posts, by source
+        :param stale: the sources of the posts to render
+
+        :returns: the sources of the posts to render
+        """
+        self.related = {}
+        if not stale and not self.changed:
+            return stale
+        # newest first, ties go to the newest post
+        ordered = sorted(sources, reverse=True)
+        for f in stale:
+            with profiler.get_active().post(f):
+                self.headers[f] = Post(f, self.blog_url, self.settings, processor.MarkdownProcessor)
+        headers = dict((f, posts[f] if f in posts else self.headers[f]) for f in ordered)
+        found = related([post_features(headers[f]) for f in ordered], self.settings.RELATED_POSTS)
+        stale = list(stale)
+        for f, pairs in itertools.izip(ordered, found):
+            self.related[f] = [{
+                'title': headers[ordered[j]]['metadata']['title'],
+                'url': headers[ordered[j]]['url'],
+                'pub_date': headers[ordered[j]]['metadata']['pub_date'],
+            } for j, score in pairs]
+            if f in posts and posts[f].get('related') != self.related[f]:
+                self.logger.debug("The related posts of %s changed", f)
+                del posts[f]
+                stale.append(f)
+        return stale
+
+    def _restore_post(self, f, data):
+        """Builds the post of the source `f` from the manifest data
+
+        :returns: Post, or PostSummary in low memory mode
+        """
+        if self.settings.LOW_MEMORY:
+            return PostSummary(data, loader=lambda: self._load_html(f))
+        return Post.restore(data)
+
+    def _summarize_post(self, f, post):
+        """Replaces a rendered post with its summary, whose body is loaded
+        again from `f` only when needed.
+
+        :returns: PostSummary
+        """
+        return PostSummary(post, loader=lambda: self._load_html(f))
+
+    def _load_html(self, f):
+        """Processes the post at `f` again to get its HTML
+
+        :returns: string
+        """
+        self.logger.debug("Loading the body of %s", f)
+        return Post(f, self.blog_url, self.settings, processor.MarkdownProcessor).get_lazy('html')
+
+    def _render_posts(self, sources):
+        """Renders the posts of the given sources, spreading them across
+        settings.JOBS worker processes when it's greater than 1.
+
+        Posts are yielded as soon as they are rendered, so the caller does
+        not need to hold all of them at once.
+
+        :param sources: the paths of the post files
+        :type sources: list
+
+        :returns: an iterator over the rendered posts, in the same order
+        """
+        jobs = self.settings.JOBS
+        if jobs <= 1 or len(sources) <= 1:
+            for f in sources:
+                yield self._render_post(f)
+            return
+        self.logger.info("Rendering %d posts with %d jobs", len(sources), jobs)
+        # load the template before forking, so workers don't each load it
+        self._template('post')
+        # the workers get this instance as they're forked, not pickled. One
+        # instance forks at a time, so none is forked in the middle of
+        # another instance setting up its pool
+        with _fork_lock:
+            pool = multiprocessing.Pool(jobs, _init_worker, (self,))
+        try:
+            for f, (post, stats, timings) in itertools.izip(sources, pool.imap(_render_post, sources, max(1, len(sources) // (jobs * 4)))):
+                for k, v in stats.items():
+                    if v:
+                        self.metrics.incr(k, v)
+                profiler.get_active().add_post_timings(f, timings)
+                yield post
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    def _render_post(self, f):
+        """Reads, processes and renders the post at `f`
+
+        :param f: the path of the post file
+        :type f: string
+
+        :returns: Post
+        """
+        with profiler.get_active().post(f):
+            self.logger.info("Processing %s...", f)
+            post = self.headers.get(f)
+            if post is None:
+                post = Post(f, self.blog_url, self.settings, processor.MarkdownProcessor)
+            post.load()
+            post['related'] = self.related.get(f, [])
+
             # make sure we have the final path created
             if not os.path.exists(os.path.dirname(post['output_path'])) or not os.path.isdir(os.path.dirname(post['output_path'])):
-                self.logger.debug("Output directory %s not found, creating" % (os.path.dirname(post['output_path']),))
-                os.makedirs(os.path.dirname(post['output_path']))
+                self.logger.debug("Output directory %s not found, creating", os.path.dirname(post['output_path']))
+                try:
+                    os.makedirs(os.path.dirname(post['output_path']))
+                except OSError:
+                    # another worker may have created it meanwhile
+                    if not os.path.isdir(os.path.dirname(post['output_path'])):
+                        raise
+
+            context = self._context({'post': post})
+            self.logger.debug("tpl_vars: %s", context)
+            with profiler.get_active().span('render'):
+                output = self._render('post', context)
+            self.logger.info("Generating output file in %s", post['output_path'])
+            with profiler.get_active().span('write'):
+                self._write_file(post['output_path'], output)
+            return post
+
+    def _pages_path(self, prefix):
+        """Calculates the PATH of the directory holding the pages of a
+        paginated listing but the first one.
+
+        :param prefix: the list of path components of the listing
+        :type prefix: list
+
+        :returns: string
+        """
+        return os.path.sep.join([self.settings.OUTPUT_PATH] + prefix + ['page'])
+
+    def _pages_url(self, prefix):
+        """Calculates the URL of the directory holding the pages of a
+        paginated listing but the first one.
+
+        :param prefix: the list of path components of the listing
+        :type prefix: list
+
+        :returns: string
+        """
+        return os.path.sep.join(prefix + ['page'])
+
+    def _paginate(self, posts, page_size, path, url, prefix):
+        """Splits a listing of posts in pages.
+
+        The first page is written to `path`, the rest to page/N.html under
+        the listing `prefix`. Every page gets a `pagination` dict with the
+        keys page, pages, prev and next (the URLs of the adjacent pages or
+        None) and urls (the URLs of all the pages).
 
-            self.tpl_vars.update({'post': post})
-            self.logger.debug("tpl_vars: %s" % (self.tpl_vars,))
-            output = self.jenv.get_template(self.settings.TEMPLATES['post']).render(self.tpl_vars)
-            self.logger.info("Generating output file in %s" % (post['output_path'],))
-            self._write_file(post['output_path'], output)
-            self.tpl_vars.pop('post') # remove the aded key
+        :param posts: the posts to list
+        :param page_size: the number of posts per page, None for a single page
+        :param path: the PATH of the first page
+        :param url: the URL of the first page, relative to the blog URL
+        :param prefix: the list of path components of the listing
+
+        :returns: a list of (posts, path, pagination) tuples
+        """
+        if page_size:
+            chunks = [posts[i:i + page_size] for i in range(0, len(posts), page_size)] or [[]]
+        else:
+            chunks = [posts]
+        paths = [path]
+        urls = [os.path.sep.join([self.blog_url, url])]
+        for n in range(2, len(chunks) + 1):
+            paths.append(os.path.sep.join([self._pages_path(prefix), "%d.html" % (n,)]))
+            urls.append(os.path.sep.join([self.blog_url, self._pages_url(prefix), "%d.html" % (n,)]))
+        pages = []
+        for i, chunk in enumerate(chunks):
+            pages.append((chunk, paths[i], {
+                'page': i + 1,
+                'pages': len(chunks),
+                'prev': urls[i - 1] if i > 0 else None,
+                'next': urls[i + 1] if i + 1 < len(chunks) else None,
+                'urls': urls,
+            }))
+        return pages
+
+    def _remove_pages(self, prefix, keep=0):
+        """Removes the pages of a paginated listing beyond the first `keep`
+
+        :param prefix: the list of path components of the listing
+        :type prefix: list
+        """
+        pages_path = self._pages_path(prefix)
+        if not os.path.isdir(pages_path):
+            return
+        for name in os.listdir(pages_path):
+            number = os.path.splitext(name)[0]
+            if number.isdigit() and int(number) > keep:
+                self._remove_file(os.path.sep.join([pages_path, name]))
+        if prefix:
+            try:
+                os.rmdir(os.path.dirname(pages_path))
+            except OSError:
+                pass
+
+    def _do_listing(self, kind, posts, page_size, path, url, prefix, context):
+        """Renders a listing of posts with the template of `kind`,
+        paginated as explained in _paginate.
+
+        :param context: a callable which gets the posts of one page and
+            returns the template variables listing them
+        """
+        pages = self._paginate(posts, page_size, path, url, prefix)
+        for page_posts, page_path, pagination in pages:
+            page_vars = context(page_posts)
+            page_vars['pagination'] = pagination
+            self._page(kind, page_path, page_vars)
+        self._remove_pages(prefix, len(pages))
 
     def _do_tag(self, tag):
         """Create the page for the tag 'tag'
         """
-        self.tpl_vars.update({'tag': tag})
-        output = self.jenv.get_template(self.settings.TEMPLATES['tag']).render(self.tpl_vars)
-        self.logger.info("Generating tag page for %s in %s" % (tag['tag'], tag['path']))
-        self._write_file(tag['path'], output)
-        # remove added keys
-        self.tpl_vars.pop('tag') 
+        if not self._needs_render(tag['path'], tag['tag'] in self.dirty_tags):
+            return
+        self.logger.info("Generating tag page for %s in %s", tag['tag'], tag['path'])
+        self._do_listing('tag', tag['posts'], self.settings.TAG_PAGE_SIZE,
+                tag['path'], tag['url'], [self.settings.TAGS_PREFIX, tag['tag']],
+                lambda posts: {'tag': dict(tag, posts=posts)})
 
     def _do_tags(self):
         """Do the tags index page
         """
         tags_dir = os.path.sep.join([self.settings.OUTPUT_PATH, self.settings.TAGS_PREFIX]) 
         if not os.path.exists(tags_dir) or not os.path.isdir(tags_dir):
-            self.logger.debug("Tag files directory %s not found, creating" % (tags_dir,))
+            self.logger.debug("Tag files directory %s not found, creating", tags_dir)
             os.makedirs(tags_dir)
-        self.tpl_vars.update({'tags': self.tags})
-        output = self.jenv.get_template(self.settings.TEMPLATES['taglist']).render(self.tpl_vars)
-        self._write_file(self._tag_index_path(), output)
-        self.tpl_vars.pop('tags')
+        for t in self.dirty_tags.difference(self.tags.keys()):
+            # no post is tagged with it anymore
+            self._remove_file(Tag(tag=t, settings=self.settings)['path'])
+            self._remove_pages([self.settings.TAGS_PREFIX, t])
+        if self._needs_render(self._tag_index_path(), self.changed):
+            self._page('taglist', self._tag_index_path(), {'tags': self.tags})
         for t in self.tags.keys():
             self._do_tag(self.tags[t])
 
     def _do_author(self, author):
         """Create the page for the author 'author'
         """
-        self.tpl_vars.update({'author': author})
-        output = self.jenv.get_template(self.settings.TEMPLATES['author']).render(self.tpl_vars)
-        self.logger.info("Generating author page for %s in %s" % (author['author'], self._author_path(author['author'])))
-        self._write_file(self._author_path(author['author']), output)
-        # remove added keys
-        self.tpl_vars.pop('author') 
+        if not self._needs_render(self._author_path(author['author']), author['author'] in self.dirty_authors):
+            return
+        self.logger.info("Generating author page for %s in %s", author['author'], self._author_path(author['author']))
+        self._do_listing('author', author['posts'], self.settings.AUTHOR_PAGE_SIZE,
+                self._author_path(author['author']), author['url'], [self.settings.AUTHORS_PREFIX, author['author']],
+                lambda posts: {'author': dict(author, posts=posts)})
 
     def _do_authors(self):
         """Do the authors index page
         """
         if not os.path.exists(self._author_path()) or not os.path.isdir(self._author_path()):
-            self.logger.debug("Author files directory %s not found, creating" % (self._author_path(),))
+            self.logger.debug("Author files directory %s not found, creating", self._author_path())
             os.makedirs(self._author_path())
-        self.tpl_vars.update({'authors': self.authors})
-        output = self.jenv.get_template(self.settings.TEMPLATES['authorlist']).render(self.tpl_vars)
-        self._write_file(self._author_index_path(), output)
-        self.tpl_vars.pop('authors')
+        for a in self.dirty_authors.difference(self.authors.keys()):
+            # no post is written by them anymore
+            self._remove_file(self._author_path(a))
+            self._remove_pages([self.settings.AUTHORS_PREFIX, a])
+        if self._needs_render(self._author_index_path(), self.changed):
+            self._page('authorlist', self._author_index_path(), {'authors': self.authors})
         for a in self.authors.keys():
             self._do_author(self.authors[a])
 
     def _do_index(self):
         # ------ POSTS INDEX ------
-        # let's sort the posts in chronological order
-        self.posts.sort(lambda x, y: cmp(x['metadata']['pub_date'], y['metadata']['pub_date']))
-        # Update the blog.last_updated key for self.tpl_vars
-        self.tpl_vars['blog']['last_updated'] = self.posts[0]['metadata']['pub_date']
-        if self.settings.POSTS_SORT_REVERSE:
-            self.posts.reverse()
-        self.tpl_vars.update({'posts': self.posts[:self.settings.POSTS_COUNT]})
-        self.logger.info("Generating index page at %s" % (self._index_path(),))
-        output = self.jenv.get_template(self.settings.TEMPLATES['index']).render(self.tpl_vars)
-        self._write_file(self._index_path(), output)
-        self.tpl_vars.pop('posts')
+        # posts are in chronological order already, see PostIndex
+        if not self._needs_render(self._index_path(), self.changed):
+            return
+        self.logger.info("Generating index page at %s", self._index_path())
+        if self.settings.INDEX_PAGINATE:
+            posts, page_size = self.posts, self.settings.POSTS_COUNT
+        else:
+            posts, page_size = self.posts[:self.settings.POSTS_COUNT], None
+        self._do_listing('index', posts, page_size,
+                self._index_path(), self._index_url(), [],
+                lambda posts: {'posts': posts})
+
+    def _archives(self):
+        """Lists the years and months with posts, in posts order, for the
+        date archive pages. Each one is a dict with the keys year, month
+        (None for years), date, count, url and, for years, months.
+
+        :returns: list
+        """
+        archives = []
+        years = {}
+        for (year, month), posts in self.index.months.items():
+            if year not in years:
+                years[year] = {
+                    'year': year,
+                    'month': None,
+                    'date': datetime.date(year, 1, 1),
+                    'count': len(self.index.years[year]),
+                    'url': os.path.sep.join([self.blog_url, self._period_url((year,))]),
+                    'months': [],
+                }
+                archives.append(years[year])
+            years[year]['months'].append({
+                'year': year,
+                'month': month,
+                'date': datetime.date(year, month, 1),
+                'count': len(posts),
+                'url': os.path.sep.join([self.blog_url, self._period_url((year, month))]),
+            })
+        return archives
 
     def _do_archive(self):
-        self.tpl_vars.update({'posts': self.posts[:]})
-        self.logger.info("Generating archive page at %s " % (self._archive_path(),))
-        output = self.jenv.get_template(self.settings.TEMPLATES['archive']).render(self.tpl_vars)
-        self._write_file(self._archive_path(), output)
-        self.tpl_vars.pop('posts')
+        if not self._needs_render(self._archive_path(), self.changed):
+            return
+        self.logger.info("Generating archive page at %s ", self._archive_path())
+        archives = self._archives() if self.date_archives else []
+        self._do_listing('archive', self.posts, self.settings.ARCHIVE_PAGE_SIZE,
+                self._archive_path(), self._archive_url(), [self.settings.ARCHIVE_PREFIX],
+                lambda posts: {'posts': posts, 'archives': archives})
+
+    def _do_period(self, kind, period, posts, archive):
+        """Create the archive page of a year or a month
+
+        The page only gets its own period, not the whole archives, as it's
+        rendered again only when the posts of the period change.
+
+        :param kind: 'year' or 'month'
+        :param period: (year,) or (year, month)
+        :param posts: the posts published in the period
+        :param archive: the entry of the period in archives, see _archives
+        """
+        if not self._needs_render(self._period_path(period), period in self.dirty_periods):
+            return
+        self.logger.info("Generating %s archive page at %s", kind, self._period_path(period))
+        self._do_listing(kind, posts, self.settings.ARCHIVE_PAGE_SIZE,
+                self._period_path(period), self._period_url(period), self._period_prefix(period),
+                lambda posts: {'posts': posts, 'period': archive})
+
+    def _do_periods(self):
+        """Do the archive pages of every year and month with posts
+        """
+        for period in self.dirty_periods:
+            if (len(period) == 1 and period[0] not in self.index.years) or \
+                    (len(period) == 2 and period not in self.index.months):
+                # no post was published then anymore
+                self._remove_pages(self._period_prefix(period))
+                self._remove_file(self._period_path(period))
+        for year in self._archives():
+            self._do_period('year', (year['year'],), self.index.years[year['year']], year)
+            for month in year['months']:
+                period = (month['year'], month['month'])
+                self._do_period('month', period, self.index.months[period], month)
 
     def _do_feed(self):
         """Generates an Atom feed of the blog posts
 
         """
-        self.tpl_vars.update({'posts': self.posts})
-        self.logger.info("Generating atom.xml at %s" % (self._feed_path(),))
-        output = self.jenv.get_template(self.settings.TEMPLATES['feed']).render(self.tpl_vars)
-        self._write_file(self._feed_path(), output)
-        self.tpl_vars.pop('posts')
-        self.logger.info("atom.xml file generated.")
+        if not self._needs_render(self._feed_path(), self.changed):
+            return
+        posts = self.posts
+        if self.settings.FEED_MAX_ENTRIES:
+            # keep the newest entries
+            if self.settings.POSTS_SORT_REVERSE:
+                posts = posts[:self.settings.FEED_MAX_ENTRIES]
+            else:
+                posts = posts[-self.settings.FEED_MAX_ENTRIES:]
+        self.logger.info("Generating atom.xml at %s", self._feed_path())
+        # the feed holds every post body, in low memory mode don't build it
+        # all in memory
+        self._page('feed', self._feed_path(), {'posts': posts}, stream=self.settings.LOW_MEMORY)
+
+    def _post_terms(self, f, post, stopwords, options):
+        """Counts the terms of the post of the source `f` for the search
+        index. They're kept in the HTML cache, by the contents of the
+        source, so unchanged posts are not split in terms again.
+
+        :param options: what, besides the source, determines the terms
+
+        :returns: dict
+        """
+        if not self.html_cache:
+            return post_terms(post, stopwords)
+        entry = self.manifest.sources.get(f) if self.manifest else None
+        key = cache_key('search', options, entry['hash'] if entry else file_digest(f))
+        cached = self.html_cache.get(key)
+        if cached is not None:
+            return json.loads(cached)
+        terms = post_terms(post, stopwords)
+        self.html_cache.set(key, json.dumps(terms))
+        return terms
 
-    def generate(self):
+    def _do_search(self):
+        """Writes the search index of the posts and its client, see
+        oak.search
+        """
+        if not self._needs_render(self._search_path(DOCS_NAME), self.changed):
+            return
+        self.logger.info("Generating the search index at %s", self._search_path())
+        stopwords = frozenset(self.settings.SEARCH_STOPWORDS or STOPWORDS)
+        options = (SEARCH_VERSION, sorted(stopwords), processor.MarkdownProcessor().options())
+        index = SearchIndex(self.settings.SEARCH_PREFIX_LENGTH, stopwords)
+        for f in sorted(self.sources):
+            post = self.sources[f]
+            doc = [post['url'], post['metadata']['title'], post['metadata']['pub_date'].isoformat()]
+            index.add(doc, self._post_terms(f, post, stopwords, options))
+        names = set(['search.js'])
+        for name, data in index.files():
+            names.add(name)
+            self._write_file(self._search_path(name), data)
+        client = open(os.path.sep.join([os.path.dirname(__file__), 'search.js']))
+        try:
+            self._write_file(self._search_path('search.js'), client.read().decode('utf-8'))
+        finally:
+            client.close()
+        # the shards no term starts with anymore
+        if os.path.isdir(self._search_path()):
+            for name in os.listdir(self._search_path()):
+                if name.endswith('.json') and name not in names:
+                    self._remove_file(self._search_path(name))
+
+    def generate(self, changed=None, revision=None):
         """Generates the HTML files to be published.
 
-        :raises: MarkupError, RenderError
+        It can be called again on the same instance, which then reuses the
+        manifest of the previous generation instead of loading it again.
+
+        :param changed: in incremental mode, the paths known to have changed
+            since the last generation. When given, the sources not listed are
+            trusted to be unchanged without checking them.
+        :type changed: list
+        :param revision: in incremental mode, the git revision the sources
+            are at, recorded in the manifest. When `changed` is None, the
+            files git reports as changed since the revision the last
+            generation recorded are taken as the changed ones, or every
+            source is checked if it recorded none.
+        :type revision: string
+
+        :raises: MarkupError, RenderError, WriteError
         """
-        self.logger.info("Using '%s' as layout path." % (self.settings.DEFAULT_LAYOUT,))
+        self.logger.info("Using '%s' as layout path.", self.settings.DEFAULT_LAYOUT)
+
+        self.posts = []
+        self.headers = {}
+        self.tags = {}
+        self.authors = {}
+        start = time.time()
+        self.metrics.reset(('written', 'copied', 'skipped', 'bytes_written', 'pages'))
+        self.stats = self.metrics.counters
+        self.metrics.event('generate')
+        # templates edited since the last generation are loaded again
+        self.templates = {}
+        self.date_archives = self._date_archives()
+        self.changed = False
+        self.dirty_tags = set()
+        self.dirty_authors = set()
+        self.dirty_periods = set()
+        self._activate()
+        # statics go first, pages link to their fingerprinted copies
+        with self._phase('_copy_statics'):
+            self._copy_statics()
+            if self.settings.ASSET_HASHING:
+                self._do_assets()
+        if self.settings.INCREMENTAL:
+            # pages have to be rendered again when the assets they link change
+            fingerprint = build_fingerprint(self.settings, os.path.sep.join([self.settings.LAYOUTS_PATH, self.settings.DEFAULT_LAYOUT]),
+                                            self.assets.manifest if self.assets else None)
+            if self.manifest is None or self.manifest.fingerprint != fingerprint:
+                self.manifest = Manifest(self._manifest_path(), fingerprint)
+                if not self.manifest.load():
+                    self.logger.info("No usable manifest found at %s, doing a full build.", self._manifest_path())
+            if changed is None and revision and self.manifest.revision:
+                # not the revision before the last pull, the last generation
+                # may have failed
+                try:
+                    changed = changed_since(self.manifest.revision)
+                    self.logger.info("%d files changed since %s, the revision generated last", len(changed), self.manifest.revision)
+                except VCSError, e:
+                    self.logger.warning("Unable to list the changes since %s, checking every file: %s", self.manifest.revision, e.msg)
+        self.changed_sources = set(os.path.abspath(f) for f in changed) if changed is not None else None
 
-        self._do_posts()
-        self._do_tags()
-        self._do_authors()
-        self._copy_statics()
-        self._do_index()
-        # the feed MUST be done after the index
-        if self.settings.GENERATE_FEED:
-            self._do_feed()
-        self._do_archive()
+        self.page_results = []
+        if self.settings.ASYNC_WRITES:
+            self.writer = Writer(self.settings.WRITE_QUEUE_SIZE, self.settings.WRITE_BATCH_SIZE,
+                                 self.settings.FSYNC, self._written)
+        try:
+            with self._phase('_do_posts'):
+                self._do_posts()
+            if self.settings.GENERATE_SEARCH_INDEX:
+                with self._phase('_do_search'):
+                    self._do_search()
+            if self.settings.JOBS > 1:
+                # listing pages are rendered by threads, which mostly overlap
+                # writing the files and processing the bodies in low memory
+                # mode. They're started once the post workers are done forking
+                self.page_pool = ThreadPool(self.settings.JOBS, self._activate)
+            with self._phase('_do_tags'):
+                self._do_tags()
+            with self._phase('_do_authors'):
+                self._do_authors()
+            with self._phase('_do_index'):
+                self._do_index()
+            # the feed MUST be done after the index
+            if self.settings.GENERATE_FEED:
+                with self._phase('_do_feed'):
+                    self._do_feed()
+            with self._phase('_do_archive'):
+                self._do_archive()
+            if self.date_archives:
+                with self._phase('_do_periods'):
+                    self._do_periods()
+            with self._phase('_wait_pages'):
+                self._wait_pages()
+            if self.writer:
+                # the manifest is saved and the files compressed once
+                # they're all written
+                with self._phase('_wait_writes'):
+                    self.writer.close()
+        except:
+            # the manifest in memory may not match the site anymore
+            self.manifest = None
+            if self.page_pool:
+                self.page_pool.terminate()
+            if self.writer:
+                self.writer.abort()
+            raise
+        finally:
+            if self.page_pool:
+                self.page_pool.close()
+                self.page_pool.join()
+                self.page_pool = None
+            self.writer = None
+        if self.manifest:
+            self.manifest.revision = revision
+            self.manifest.save()
+        if self.assets:
+            removed = self.assets.remove_stale()
+            if removed:
+                self.logger.info("Removed %d outdated asset copies", removed)
+        with self._phase('_do_compress'):
+            self._do_compress()
+        self.logger.info("%d files written, %d copied and %d left untouched.", self.stats['written'], self.stats['copied'], self.stats['skipped'])
+        self.metrics.timing('generate', time.time() - start)
+        if self.highlight_cache:
+            evicted = self.highlight_cache.prune()
+            if evicted:
+                self.logger.info("Evicted %d code blocks from the highlight cache", evicted)
+        if self.html_cache:
+            evicted = self.html_cache.prune()
+            if evicted:
+                self.logger.info("Evicted %d posts from the HTML cache", evicted)
 
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""Oak static assets pipeline
+
+Once the static files are copied to the output, a copy of every CSS and
+JavaScript file is written with a hash of its contents in the name
+(css/main.css gets css/main.3f2a1c9e.css), optionally minified. As the
+name changes whenever the contents do, those copies can be served with
+far-future cache headers.
+
+The original names are mapped to the hashed ones in the assets manifest,
+written next to the static files as assets.json, and templates get the
+URL of the hashed copies through the `asset` helper:
+
+    <script src="{{ asset('js/site.js') }}"></script>
+
+"""
+
+import hashlib
+import json
+import os
+import re
+
+from oak.utils import write_if_changed
+
+# The name of the assets manifest, under the output static path
+MANIFEST_NAME = 'assets.json'
+
+# The length of the hash in the names of the copies
+HASH_LENGTH = 8
+
+# Strings and url() values, left as they are, or comments, removed
+_CSS_SKIP_RE = re.compile(r"""("(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|"""
+                          r"""url\(\s*(?:"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|[^)]*?)\s*\))|/\*.*?\*/""",
+                          re.S | re.I)
+_CSS_SPACES_RE = re.compile(r'\s+')
+_CSS_AFTER_RE = re.compile(r'([{};,>]) ')
+_CSS_BEFORE_RE = re.compile(r' ([{};,>])')
+
+# The names of the fingerprinted copies, see hashed_name
+_COPY_RE = re.compile(r'^(.*)\.[0-9a-f]{%d}(\.[^./]+)$' % (HASH_LENGTH,))
+
+
+def _minify_css_code(text):
+    text = _CSS_SPACES_RE.sub(' ', text)
+    text = _CSS_AFTER_RE.sub(r'\1', text)
+    text = _CSS_BEFORE_RE.sub(r'\1', text)
+    return text.replace(';}', '}')
+
+
+def minify_css(text):
+    """Minifies CSS: rcssmin is used if installed, otherwise comments and
+    the whitespace around punctuation are removed, leaving strings and
+    url() values alone.
+
+    :returns: string
+    """
+    try:
+        import rcssmin
+    except ImportError:
+        pieces = _CSS_SKIP_RE.split(text)
+        # the code between the strings and urls, comments removed
+        code = [pieces[0]]
+        kept = []
+        for i in range(1, len(pieces), 2):
+            if pieces[i] is None:
+                code[-1] += pieces[i + 1]
+            else:
+                kept.append(pieces[i])
+                code.append(pieces[i + 1])
+        result = [_minify_css_code(code[0])]
+        for value, c in zip(kept, code[1:]):
+            result.extend([value, _minify_css_code(c)])
+        return ''.join(result).strip()
+    return rcssmin.cssmin(text)
+
+
+def minify_js(text):
+    """Minifies JavaScript with rjsmin, if installed, otherwise returns it
+    as is.
+
+    :returns: string
+    """
+    try:
+        import rjsmin
+    except ImportError:
+        return text
+    return rjsmin.jsmin(text)
+
+MINIFIERS = {
+    '.css': minify_css,
+    '.js': minify_js,
+}
+
+
+def hashed_name(name, contents):
+    """Returns `name` with the hash of `contents` before its extension
+
+    :returns: string
+    """
+    base, ext = os.path.splitext(name)
+    return "%s.%s%s" % (base, hashlib.sha1(contents).hexdigest()[:HASH_LENGTH], ext)
+
+
+class Assets(object):
+    """The fingerprinted copies of the static files of a site"""
+
+    def __init__(self, path, extensions=('.css', '.js'), minify=False):
+        """Initializes the pipeline
+
+        :param path: the output static path
+        :param extensions: the extensions of the files to fingerprint
+        :param minify: whether to minify the copies
+        """
+        self.path = path
+        self.extensions = extensions
+        self.minify = minify
+        self.manifest = {}
+        self.stale = []
+
+    def _manifest_path(self):
+        return os.path.sep.join([self.path, MANIFEST_NAME])
+
+    def _is_copy(self, root, name):
+        """Tells whether the file `name` in the directory `root` looks
+        like a fingerprinted copy of a file next to it
+
+        :returns: bool
+        """
+        m = _COPY_RE.match(name)
+        return m is not None and os.path.exists(os.path.join(root, m.group(1) + m.group(2)))
+
+    def load(self):
+        """Loads the manifest written by a previous run
+
+        :returns: dict
+        """
+        try:
+            f = open(self._manifest_path())
+        except IOError:
+            return {}
+        try:
+            return json.load(f)
+        except ValueError:
+            return {}
+        finally:
+            f.close()
+
+    def run(self):
+        """Writes the fingerprinted copies which don't exist yet and the
+        manifest. The copies of previous runs which are not in the new
+        manifest are listed in `stale`, see remove_stale.
+
+        :returns: the count of copies written
+        """
+        previous = self.load()
+        copies = set(previous.values())
+        self.manifest = {}
+        written = 0
+        for root, dirs, files in os.walk(self.path):
+            dirs.sort()
+            for name in sorted(files):
+                ext = os.path.splitext(name)[1]
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, self.path).replace(os.path.sep, '/')
+                if ext not in self.extensions or rel in copies or rel == MANIFEST_NAME:
+                    continue
+                if self._is_copy(root, name):
+                    # left over by a run whose manifest is gone
+                    copies.add(rel)
+                    continue
+                f = open(path, 'rb')
+                try:
+                    contents = f.read()
+                finally:
+                    f.close()
+                if self.minify and ext in MINIFIERS:
+                    contents = MINIFIERS[ext](contents)
+                self.manifest[rel] = hashed_name(rel, contents)
+                copy = os.path.sep.join([self.path, self.manifest[rel]])
+                # the name tells the contents, an existing copy is up to date
+                if not os.path.exists(copy):
+                    write_if_changed(copy, contents)
+                    written += 1
+        current = set(self.manifest.values())
+        self.stale = [os.path.sep.join([self.path, c]) for c in copies if c not in current]
+        write_if_changed(self._manifest_path(), json.dumps(self.manifest, indent=2, sort_keys=True))
+        return written
+
+    def remove_stale(self):
+        """Removes the copies left over by previous runs, once no page
+        links to them anymore.
+
+        :returns: the count of removed copies
+        """
+        removed = 0
+        for path in self.stale:
+            if os.path.exists(path):
+                os.remove(path)
+                removed += 1
+        self.stale = []
+        return removed
+
+    def url(self, name):
+        """Returns the path of the fingerprinted copy of the static file
+        `name`, or `name` itself if it has none.
+
+        :param name: the path of the file, relative to the static path
+        :returns: string
+        """
+        return self.manifest.get(name, name)
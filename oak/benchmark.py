@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""Oak benchmark
+
+Generates synthetic blog projects and measures how fast oak renders them
+with the bundled layouts. It's pretended to be called from oak-bench.py:
+
+$ oak-bench.py --posts 1000 --layouts default,clean
+
+Every run reports the throughput in posts per second, the peak memory
+and the time spent in each generation phase. Results are appended as
+JSON lines to a results file, along with the oak commit they were taken
+at, so runs from different commits can be compared with --compare.
+
+"""
+
+import datetime
+import imp
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import StringIO
+
+from optparse import OptionParser
+
+import oak
+from oak.manager import Manager
+from oak.profiler import Profiler
+from oak.utils import fill_settings
+
+LAYOUTS = ['default', 'default_v2', 'default_blue', 'clean']
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+         "tempor incididunt ut labore et dolore magna aliqua enim ad minim veniam "
+         "quis nostrud exercitation ullamco laboris nisi aliquip ex ea commodo "
+         "consequat duis aute irure in reprehenderit voluptate velit esse cillum "
+         "fugiat nulla pariatur excepteur sint occaecat cupidatat non proident").split()
+
+CODE = '''def fib_%(n)d(n):
+    """Returns the n-th Fibonacci number"""
+    a, b = 0, %(n)d
+    for i in range(n):
+        a, b = b, a + b
+    return a
+
+class Node%(n)d(object):
+    def __init__(self, value, children=None):
+        self.value = value
+        self.children = children or []
+'''
+
+
+def _sentence(rnd, words=12):
+    return ' '.join(rnd.choice(WORDS) for i in range(words)).capitalize() + '.'
+
+
+def generate_corpus(path, posts=100, tags_per_post=3, tags=50, authors=5,
+                    code_blocks=1, paragraphs=8, statics=10, seed=0):
+    """Creates a synthetic oak project at `path`, as Manager.init does, and
+    fills it with posts and static files.
+
+    :param path: the project path, must not exist
+    :param posts: the number of posts
+    :param tags_per_post: the number of tags of each post
+    :param tags: the number of distinct tags
+    :param authors: the number of distinct authors
+    :param code_blocks: the number of highlighted code blocks per post
+    :param paragraphs: the number of text paragraphs per post
+    :param statics: the number of static files
+    :param seed: the seed of the random contents, same seed same corpus
+    """
+    rnd = random.Random(seed)
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO() # Manager.init talks to the user
+    try:
+        Manager().init(path)
+    finally:
+        sys.stdout = stdout
+    content = os.path.sep.join([path, 'content'])
+    start = datetime.datetime(2005, 1, 1)
+    for i in range(posts):
+        pub_date = start + datetime.timedelta(hours=i * 7)
+        post_tags = rnd.sample(range(tags), min(tags_per_post, tags))
+        body = []
+        for p in range(paragraphs):
+            body.append(' '.join(_sentence(rnd) for s in range(5)))
+            if p < code_blocks:
+                body.append("[sourcecode:python]\n%s[/sourcecode]" % (CODE % {'n': i * 100 + p},))
+        for p in range(paragraphs, code_blocks):
+            body.append("[sourcecode:python]\n%s[/sourcecode]" % (CODE % {'n': i * 100 + p},))
+        f = open(os.path.sep.join([content, "%s-post-%d.md" % (pub_date.strftime('%Y-%m'), i)]), 'w')
+        f.write("---\n  title: '%s'\n  author: 'author %d'\n  pub_date: %s\n  tags: [%s]\n---\n\n%s\n\n%s\n" % (
+            _sentence(rnd, 5)[:-1], rnd.randrange(authors), pub_date.strftime('%Y-%m-%d %H:%M:%S'),
+            ', '.join("'tag%d'" % (t,) for t in post_tags),
+            _sentence(rnd, 5)[:-1], '\n\n'.join(body)))
+        f.close()
+    static = os.path.sep.join([path, 'static'])
+    for i in range(statics):
+        d = os.path.sep.join([static, "dir%d" % (i % 5,)])
+        if not os.path.isdir(d):
+            os.makedirs(d)
+        f = open(os.path.sep.join([d, "asset%d.css" % (i,)]), 'w')
+        f.write("/* asset %d */\n" % (i,) + "body .c%d { margin: %dpx; }\n" % (i, i) * 200)
+        f.close()
+
+
+def _generate(path, layout, jobs, warm, queue):
+    """Generates the project at `path` and puts the measures in `queue`.
+    It runs in a child process, so the peak memory is that of one build.
+    """
+    try:
+        os.chdir(path)
+        settings = fill_settings(imp.load_source('oak_bench_settings', os.path.sep.join([path, 'settings.py'])))
+        settings.DEFAULT_LAYOUT = layout
+        settings.LAYOUTS_PATH = os.path.sep.join([os.path.dirname(oak.__file__), 'layouts'])
+        settings.JOBS = jobs
+        if not warm:
+            if os.path.isdir(settings.CACHE_PATH):
+                shutil.rmtree(settings.CACHE_PATH)
+            if os.path.isdir(settings.OUTPUT_PATH):
+                shutil.rmtree(settings.OUTPUT_PATH)
+        logger = logging.getLogger('oak.benchmark')
+        logger.addHandler(logging.NullHandler())
+        logger.propagate = False
+        my_oak = oak.Oak(logger=logger, settings=settings)
+        my_oak.profiler = Profiler()
+        start = time.time()
+        my_oak.generate()
+        seconds = time.time() - start
+        queue.put({
+            'seconds': seconds,
+            'posts_per_sec': len(my_oak.posts) / seconds if seconds else None,
+            # workers, if any, count as children
+            'peak_rss_kb': max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss),
+            'phases': dict((p['name'], p['wall']) for p in my_oak.profiler.phases),
+            'parts': my_oak.profiler.totals(),
+        })
+    except Exception, e:
+        queue.put({'error': "%s: %s" % (e.__class__.__name__, e)})
+
+
+def run_once(path, layout='default', jobs=1, warm=False):
+    """Generates the project at `path` once, in a child process
+
+    :param path: the project path
+    :param layout: the layout to generate with
+    :param jobs: the number of processes rendering posts
+    :param warm: whether to keep the caches and output of previous runs
+
+    :returns: dict with the measures
+    """
+    queue = multiprocessing.Queue()
+    child = multiprocessing.Process(target=_generate, args=(path, layout, jobs, warm, queue))
+    child.start()
+    result = queue.get()
+    child.join()
+    if 'error' in result:
+        raise Exception(result['error'])
+    return result
+
+
+def current_commit():
+    """Returns the commit of the oak source tree, or None
+    """
+    try:
+        p = subprocess.Popen(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(oak.__file__),
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate()
+    except OSError:
+        return None
+    if p.returncode:
+        return None
+    return out.strip()
+
+
+class Benchmark(object):
+    def __init__(self):
+        pass
+
+    def report(self, result):
+        """Formats a result as a line of text
+        """
+        phases = ', '.join("%s %.2fs" % (name, result['phases'][name]) for name in sorted(result['phases']))
+        return "%-13s %8.1f posts/s %8.2fs %9d KB  (%s)" % (result['layout'], result['posts_per_sec'] or 0,
+                                                            result['seconds'], result['peak_rss_kb'], phases)
+
+    def compare(self, results_file, corpus):
+        """Prints the best throughput of every commit for each layout, for
+        runs over the same corpus
+        """
+        if not os.path.exists(results_file):
+            print("No results found at %s" % (results_file,))
+            return
+        best = {}
+        order = []
+        for line in open(results_file):
+            r = json.loads(line)
+            if r.get('corpus') != corpus:
+                continue
+            key = (r['commit'], r['layout'], r['jobs'])
+            if key[0] not in order:
+                order.append(key[0])
+            if key not in best or r['posts_per_sec'] > best[key]['posts_per_sec']:
+                best[key] = r
+        print("%-10s %-13s %5s %12s %12s" % ('commit', 'layout', 'jobs', 'posts/s', 'peak KB'))
+        previous = {}
+        for commit in order:
+            for key in sorted(k for k in best if k[0] == commit):
+                r = best[key]
+                delta = ''
+                if key[1:] in previous:
+                    delta = "%+.1f%%" % ((r['posts_per_sec'] / previous[key[1:]] - 1) * 100,)
+                previous[key[1:]] = r['posts_per_sec']
+                print("%-10s %-13s %5d %12.1f %12d %s" % (commit, r['layout'], r['jobs'], r['posts_per_sec'], r['peak_rss_kb'], delta))
+
+    def run(self, argv):
+        parser = OptionParser(usage="%prog [OPTIONS]", version="%prog 0.1")
+        parser.add_option("--posts", type="int", dest="posts", default=500, help="Number of posts")
+        parser.add_option("--tags-per-post", type="int", dest="tags_per_post", default=3, help="Number of tags of each post")
+        parser.add_option("--tags", type="int", dest="tags", default=50, help="Number of distinct tags")
+        parser.add_option("--authors", type="int", dest="authors", default=5, help="Number of distinct authors")
+        parser.add_option("--code-blocks", type="int", dest="code_blocks", default=1, help="Number of code blocks per post")
+        parser.add_option("--paragraphs", type="int", dest="paragraphs", default=8, help="Number of text paragraphs per post")
+        parser.add_option("--statics", type="int", dest="statics", default=10, help="Number of static files")
+        parser.add_option("--seed", type="int", dest="seed", default=0, help="Seed of the random contents")
+        parser.add_option("--layouts", dest="layouts", default=','.join(LAYOUTS), help="Comma separated layouts to generate with")
+        parser.add_option("-j", "--jobs", type="int", dest="jobs", default=1, help="Number of processes rendering posts")
+        parser.add_option("--repeat", type="int", dest="repeat", default=1, help="Number of runs per layout")
+        parser.add_option("--warm", action="store_true", dest="warm", default=False, help="Keep caches and output between runs")
+        parser.add_option("--project", dest="project", default=None, help="Where to create the project, a temporary directory if not set. An existing project is reused as is")
+        parser.add_option("--results", dest="results", default="oak-bench.jsonl", help="File the results are appended to")
+        parser.add_option("--compare", action="store_true", dest="compare", default=False, help="Compare the stored results instead of running")
+        (options, args) = parser.parse_args(argv)
+
+        corpus = {
+            'posts': options.posts,
+            'tags_per_post': options.tags_per_post,
+            'tags': options.tags,
+            'authors': options.authors,
+            'code_blocks': options.code_blocks,
+            'paragraphs': options.paragraphs,
+            'statics': options.statics,
+            'seed': options.seed,
+        }
+        if options.compare:
+            self.compare(options.results, corpus)
+            return
+
+        if options.project:
+            path = os.path.abspath(options.project)
+            cleanup = False
+        else:
+            path = os.path.sep.join([tempfile.mkdtemp(prefix='oak-bench-'), 'blog'])
+            cleanup = True
+        try:
+            if os.path.exists(path):
+                print("Using the existing project at %s" % (path,))
+            else:
+                print("Generating a corpus of %d posts at %s..." % (options.posts, path))
+                generate_corpus(path, **corpus)
+            commit = current_commit()
+            out = open(options.results, 'a')
+            try:
+                for layout in options.layouts.split(','):
+                    for i in range(options.repeat):
+                        result = run_once(path, layout, options.jobs, options.warm)
+                        result.update({
+                            'commit': commit,
+                            'date': datetime.datetime.now().isoformat(),
+                            'layout': layout,
+                            'jobs': options.jobs,
+                            'warm': options.warm,
+                            'corpus': corpus,
+                        })
+                        print(self.report(result))
+                        out.write(json.dumps(result, sort_keys=True) + '\n')
+            finally:
+                out.close()
+        finally:
+            if cleanup:
+                shutil.rmtree(os.path.dirname(path))
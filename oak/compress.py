@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""Precompressed copies of the generated files
+
+Web servers like nginx (gzip_static, brotli_static) can serve a file.gz
+or file.br sibling instead of compressing file on every request. These
+siblings are written for the generated files with the given extensions,
+gzip always and brotli when the brotli module is installed.
+
+A sibling gets the modification time of the file it was compressed from,
+so it's only compressed again when the file is written again. When oak
+runs without compressing, the siblings of the files written since are
+removed instead (see remove_outdated), so servers never send them.
+
+"""
+
+import gzip
+import os
+import StringIO
+
+from multiprocessing.dummy import Pool
+
+from oak.utils import write_if_changed
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _gzip(data, mtime):
+    buf = StringIO.StringIO()
+    # no file name and a fixed time, so the same file compresses the same
+    f = gzip.GzipFile(filename='', mode='wb', compresslevel=9, fileobj=buf, mtime=mtime)
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    return buf.getvalue()
+
+
+def _brotli(data, mtime):
+    return brotli.compress(data)
+
+
+def encoders(use_brotli=True):
+    """Returns the (suffix, encoder) pairs in use
+
+    :param use_brotli: whether to write brotli siblings if possible
+
+    :returns: list
+    """
+    result = [('.gz', _gzip)]
+    if use_brotli and brotli is not None:
+        result.append(('.br', _brotli))
+    return result
+
+
+def _is_fresh(sibling, st):
+    try:
+        # utime may not keep every digit of the time
+        return abs(os.stat(sibling).st_mtime - st.st_mtime) < 0.001
+    except OSError:
+        return False
+
+
+def compress_file(path, encoders):
+    """Writes the compressed siblings of `path` which are outdated
+
+    :param path: the file to compress
+    :param encoders: the (suffix, encoder) pairs, see encoders
+
+    :returns: the count of siblings written
+    """
+    st = os.stat(path)
+    outdated = [(suffix, encode) for suffix, encode in encoders
+                if not _is_fresh(path + suffix, st)]
+    if not outdated:
+        return 0
+    f = open(path, 'rb')
+    try:
+        data = f.read()
+    finally:
+        f.close()
+    for suffix, encode in outdated:
+        sibling = path + suffix
+        write_if_changed(sibling, encode(data, int(st.st_mtime)))
+        os.utime(sibling, (st.st_atime, st.st_mtime))
+    return len(outdated)
+
+
+def _walk(root, extensions):
+    """Lists the files under `root` with the given extensions and the
+    compressed siblings of such files
+
+    :returns: a tuple with the list of files and the list of (sibling,
+        suffix, file) tuples
+    """
+    files = []
+    siblings = []
+    for dirpath, dirs, names in os.walk(root):
+        for name in names:
+            path = os.path.join(dirpath, name)
+            base, ext = os.path.splitext(name)
+            if ext in extensions:
+                files.append(path)
+            elif ext in ('.gz', '.br') and os.path.splitext(base)[1] in extensions:
+                siblings.append((path, ext, os.path.join(dirpath, base)))
+    return files, siblings
+
+
+def remove_outdated(root, extensions):
+    """Removes the compressed siblings under `root` whose file is gone
+    or was written after they were compressed, for the builds which don't
+    compress the files they write.
+
+    :param root: the output directory
+    :param extensions: the extensions of the compressed files
+
+    :returns: the count of removed siblings
+    """
+    removed = 0
+    for sibling, suffix, path in _walk(root, extensions)[1]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+        if st is None or not _is_fresh(sibling, st):
+            os.remove(sibling)
+            removed += 1
+    return removed
+
+
+def precompress(root, extensions, jobs=1, use_brotli=True):
+    """Writes the compressed siblings of the files under `root` with the
+    given extensions, in `jobs` threads, and removes those whose file is
+    gone or which are not written anymore.
+
+    :param root: the output directory
+    :param extensions: the extensions of the files to compress
+    :param jobs: the number of files compressed at once
+    :param use_brotli: whether to write brotli siblings if possible
+
+    :returns: a tuple with the counts of written and removed siblings
+    """
+    encs = encoders(use_brotli)
+    active = [suffix for suffix, encode in encs]
+    files, siblings = _walk(root, extensions)
+    removed = 0
+    for sibling, suffix, path in siblings:
+        if suffix not in active or not os.path.exists(path):
+            # the file it was compressed from is gone, or it won't be
+            # kept up to date
+            os.remove(sibling)
+            removed += 1
+    if jobs <= 1 or len(files) <= 1:
+        return sum(compress_file(path, encs) for path in files), removed
+    # zlib and brotli release the GIL while compressing
+    pool = Pool(jobs)
+    try:
+        written = sum(pool.imap_unordered(lambda path: compress_file(path, encs), files, 16))
+    finally:
+        pool.close()
+        pool.join()
+    return written, removed
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""In-memory index of the blog posts.
+
+Posts are added as they are read, in any order. Once built, the index
+holds every post in publication order, keyed by id, by tag, by author
+and by month, with the lists of each key already in that same order, so
+listing pages just render them.
+
+"""
+
+from collections import OrderedDict
+
+from oak.models.tag import Tag
+from oak.models.author import Author
+
+
+def pub_date_key(post):
+    """The key posts are sorted by, their publication date
+    """
+    return post['metadata']['pub_date']
+
+
+def post_period(post):
+    """Returns the (year, month) a post was published in
+
+    :returns: tuple of ints
+    """
+    pub_date = post['metadata']['pub_date']
+    return pub_date.year, pub_date.month
+
+
+class PostIndex(object):
+    """Indexes posts by id, tag, author and month.
+
+    After build, these attributes are available:
+
+    * posts: every post, oldest first or newest first with reverse
+    * by_id: dict of the posts by id
+    * tags: OrderedDict of Tag by tag name, sorted by name
+    * authors: OrderedDict of Author by name, sorted by name
+    * years: OrderedDict of post lists by year, in posts order
+    * months: OrderedDict of post lists by (year, month), in posts order
+
+    """
+
+    def __init__(self, settings, author_url, reverse=False):
+        """Initializes an empty index
+
+        :param settings: the settings module
+        :param author_url: callable returning the URL of an author page
+        :param reverse: whether the lists go from the newest post to the oldest
+        """
+        self.settings = settings
+        self.author_url = author_url
+        self.reverse = reverse
+        self._added = []
+        self.posts = []
+        self.by_id = {}
+        self.tags = OrderedDict()
+        self.authors = OrderedDict()
+        self.years = OrderedDict()
+        self.months = OrderedDict()
+
+    def add(self, post):
+        """Adds a post to the index, it's not listed until build is called
+        """
+        self._added.append(post)
+
+    def build(self):
+        """Sorts the added posts and fills every key of the index in a
+        single pass over them.
+
+        Posts published at the same time keep the order they were added in.
+        """
+        posts = sorted(self._added, key=pub_date_key)
+        if self.reverse:
+            posts.reverse()
+        tags = {}
+        authors = {}
+        years = OrderedDict()
+        months = OrderedDict()
+        by_id = {}
+        for post in posts:
+            by_id[post['id']] = post
+            for t in post['metadata']['tags']:
+                tag = tags.get(t)
+                if tag is None:
+                    tag = tags[t] = Tag(tag=t, settings=self.settings, posts=[])
+                tag['posts'].append(post)
+            a = post['metadata']['author']
+            author = authors.get(a)
+            if author is None:
+                author = authors[a] = Author(author=a, url=self.author_url(a), posts=[])
+            author['posts'].append(post)
+            period = post_period(post)
+            years.setdefault(period[0], []).append(post)
+            months.setdefault(period, []).append(post)
+        self.posts = posts
+        self.by_id = by_id
+        self.tags = OrderedDict((t, tags[t]) for t in sorted(tags))
+        self.authors = OrderedDict((a, authors[a]) for a in sorted(authors))
+        self.years = years
+        self.months = months
+        self._added = []
+        return self
+
+    def newest(self):
+        """Returns the last post published, or None
+        """
+        if not self.posts:
+            return None
+        return self.posts[0] if self.reverse else self.posts[-1]
@@ -3,10 +3,18 @@
 import sys
 import os
 import logging
+import shutil
+import time
 
 from optparse import OptionParser, OptionGroup
 
 import oak
+from oak import server
+from oak.metrics import JSONLinesWriter
+from oak.profiler import Profiler
+from oak.vcs import changed_since, clean_revision, VCSError
+from oak.utils import fill_settings
+from oak.watcher import Watcher
 
 class Launcher(object):
     "The entrypoint for command line calls"
@@ -23,6 +31,8 @@ class Launcher(object):
     settings = None
 
     def __init__(self, settings=None):
+        if settings:
+            settings = fill_settings(settings)
         self.settings = settings
 
     def setup_logging(self, loglevel='warning'):
@@ -38,7 +48,37 @@ class Launcher(object):
         if not self.logger:
             self.logger = self.setup_logging(loglevel=loglevel)
         return self.logger
-        
+
+    def watch(self, my_oak):
+        """Generates the site again, incrementally, every time a source,
+        static file or template changes, until interrupted.
+
+        :param my_oak: the Oak instance, kept between generations
+        """
+        layout_path = os.path.sep.join([self.settings.LAYOUTS_PATH, self.settings.DEFAULT_LAYOUT])
+        watcher = Watcher([self.settings.CONTENT_PATH, self.settings.STATIC_PATH, layout_path])
+        state = {'failed': False}
+
+        def rebuild(changed):
+            self.logger.info("Changed: %s", ', '.join(changed))
+            start = time.time()
+            try:
+                # after a failure, what changed before isn't known anymore
+                my_oak.generate(changed=None if state['failed'] else changed)
+            except Exception, e:
+                self.logger.exception("Generation failed")
+                print("Generation failed: %s" % (e,))
+                state['failed'] = True
+            else:
+                print("Generated in %.3f seconds." % (time.time() - start,))
+                state['failed'] = False
+
+        print("Watching for changes, press Ctrl+C to stop.")
+        try:
+            watcher.watch(rebuild)
+        except KeyboardInterrupt:
+            pass
+
     def run(self, argv=None):
         parser = OptionParser(usage="%prog [OPTIONS]", version="%prog 0.1")
         parser.add_option("-g", "--generate", action="store_true", dest="generate", default=False, help = "Generate the source for your site.")
@@ -47,6 +87,25 @@ class Launcher(object):
         group = OptionGroup(parser, "Output options (overriding settings.py)")
         group.add_option("-l", "--layout", dest="layout", default=self.settings.DEFAULT_LAYOUT, help="Set the layout to use")
         group.add_option("-d", "--destination", dest="destination", default=self.settings.OUTPUT_PATH, help="Set the destination of the output")
+        group.add_option("--incremental", action="store_true", dest="incremental", default=self.settings.INCREMENTAL, help="Only re-render what changed since the last generation.")
+        group.add_option("--since", dest="since", default=None, metavar="REV", help="Only regenerate what changed in git since REV (or in a REV1..REV2 range), implies --incremental")
+        group.add_option("--since-generated", action="store_true", dest="since_generated", default=False, help="Only regenerate what changed in git since the revision generated last, implies --incremental")
+        group.add_option("--no-cache", action="store_false", dest="cache", default=True, help="Don't use nor update the HTML, code highlighting and compiled templates caches")
+        group.add_option("--clear-cache", action="store_true", dest="clear_cache", default=False, help="Remove every cached file and the incremental build state")
+        group.add_option("--low-memory", action="store_true", dest="low_memory", default=self.settings.LOW_MEMORY, help="Keep only a summary of each post in memory once rendered")
+        group.add_option("--precompress", action="store_true", dest="precompress", default=self.settings.PRECOMPRESS, help="Also write gzip (and brotli) compressed copies of the generated files")
+        group.add_option("-j", "--jobs", type="int", dest="jobs", default=self.settings.JOBS, help="Set the number of processes rendering posts and of threads rendering the other pages")
+        parser.add_option_group(group)
+
+        group = OptionGroup(parser, "Development options")
+        group.add_option("-w", "--watch", action="store_true", dest="watch", default=False, help="Generate, then generate again whenever something changes")
+        group.add_option("-s", "--serve", action="store_true", dest="serve", default=False, help="Like --watch, also serving the site over HTTP")
+        group.add_option("-p", "--port", type="int", dest="port", default=8000, help="Set the port the site is served on")
+        group.add_option("--compile-layout", action="store_true", dest="compile_layout", default=False, help="Compile the layout templates ahead of time into the cache")
+        group.add_option("--profile", action="store_true", dest="profile", default=False, help="Report where the generation spends its time")
+        group.add_option("--profile-json", dest="profile_json", default=None, metavar="FILE", help="Write the profiling data as JSON to FILE, implies --profile")
+        group.add_option("--profile-top", type="int", dest="profile_top", default=10, metavar="N", help="List the N slowest posts in the profiling report")
+        group.add_option("--metrics", dest="metrics", default=None, metavar="FILE", help="Write the build metrics to FILE as they change, one JSON object per line")
         parser.add_option_group(group)
 
         (options, args) = parser.parse_args()
@@ -54,24 +113,74 @@ class Launcher(object):
 
         self.setup_logging(loglevel=options.loglevel)
 
-        if options.generate:
+        if options.clear_cache:
+            if os.path.isdir(self.settings.CACHE_PATH):
+                self.logger.info("Removing the cache at %s", self.settings.CACHE_PATH)
+                shutil.rmtree(self.settings.CACHE_PATH)
+
+        if options.generate or options.watch or options.serve or options.compile_layout:
             # override settings with commandline options
             if options.layout:
                 self.settings.DEFAULT_LAYOUT=options.layout
             if options.destination:
                 self.settings.OUTPUT_PATH=options.destination
+            # watching only makes sense if just what changed is generated
+            self.settings.INCREMENTAL = options.incremental or options.watch or options.serve or bool(options.since) or options.since_generated
+            self.settings.JOBS = options.jobs
+            self.settings.LOW_MEMORY = options.low_memory
+            self.settings.PRECOMPRESS = options.precompress
+            if not options.cache:
+                self.settings.HTML_CACHE = False
+                self.settings.HIGHLIGHT_CACHE = False
+                self.settings.TEMPLATE_CACHE = False
             # set the path to the layouts directory, if LAYOUTS_PATH is not absolute, use the layouts from the package
             # TODO test!
             if not os.path.isabs(self.settings.LAYOUTS_PATH):
                 self.settings.LAYOUTS_PATH = os.path.sep.join([os.path.dirname(oak.__file__), self.settings.LAYOUTS_PATH])
-            self.logger.debug("LAYOUTS_PATH set to %s" % (self.settings.LAYOUTS_PATH,))
+            self.logger.debug("LAYOUTS_PATH set to %s", self.settings.LAYOUTS_PATH)
             self.logger.info("Settings loaded.")
             # instantiate Oak with the given settings
             my_oak = oak.Oak(logger=self.logger, settings=self.settings)
             self.logger.info("Oak initiated.")
+            if options.compile_layout:
+                count = my_oak.compile_layout()
+                print("Compiled %d templates of the %s layout." % (count, self.settings.DEFAULT_LAYOUT))
+                if not (options.generate or options.watch or options.serve):
+                    return
+            if options.profile or options.profile_json:
+                my_oak.profiler = Profiler()
+            if options.metrics:
+                my_oak.metrics.subscribe(JSONLinesWriter(open(options.metrics, 'a')))
+            changed = None
+            if options.since:
+                try:
+                    changed = changed_since(options.since)
+                    self.logger.info("%d files changed since %s", len(changed), options.since)
+                except VCSError, e:
+                    self.logger.warning("Unable to list the changes since %s, checking every file: %s", options.since, e.msg)
+            revision = None
+            if options.since_generated:
+                try:
+                    revision = clean_revision(self.settings.CONTENT_PATH)
+                except VCSError, e:
+                    self.logger.warning("Unable to find the revision of the posts, checking every file: %s", e.msg)
+                else:
+                    if revision is None:
+                        self.logger.info("The posts differ from the checked out revision, checking every file")
             # call the generation process
-            my_oak.generate()
+            my_oak.generate(changed=changed, revision=revision)
             self.logger.info("Geneartion completed.")
-        else:
+            if my_oak.profiler:
+                print(my_oak.profiler.report(top=options.profile_top))
+                if options.profile_json:
+                    my_oak.profiler.write_json(options.profile_json)
+                # later generations in watch mode are not profiled
+                my_oak.profiler = None
+            if options.serve:
+                server.serve(self.settings.OUTPUT_PATH, options.port, logger=self.logger)
+                print("Serving %s at http://localhost:%d/" % (self.settings.OUTPUT_PATH, options.port))
+            if options.watch or options.serve:
+                self.watch(my_oak)
+        elif not options.clear_cache:
             parser.print_help()
 
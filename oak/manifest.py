@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""Build manifest for incremental generation.
+
+The manifest remembers, for every source file, its mtime, size and
+content hash together with the rendered post and the files generated
+from it. Later runs use it to restore unchanged posts without reading
+or rendering them again.
+
+"""
+
+import cPickle as pickle
+import hashlib
+import os
+
+# Bump whenever the layout of the stored data changes
+MANIFEST_VERSION = 4
+
+# Settings which do not change the generated output
+VOLATILE_SETTINGS = ('INCREMENTAL', 'JOBS', 'HTML_CACHE', 'HTML_CACHE_SIZE', 'HIGHLIGHT_CACHE', 'HIGHLIGHT_CACHE_SIZE',
+                     'TEMPLATE_CACHE', 'FAST_HEADERS',
+                     'PRECOMPRESS', 'PRECOMPRESS_EXTENSIONS', 'PRECOMPRESS_BROTLI',
+                     'ASYNC_WRITES', 'WRITE_QUEUE_SIZE', 'WRITE_BATCH_SIZE', 'FSYNC')
+
+
+def file_digest(path):
+    """Calculates the SHA1 hex digest of the contents of `path`
+
+    :param path: the file to hash
+    :type path: string
+
+    :returns: string
+    """
+    h = hashlib.sha1()
+    f = open(path, 'rb')
+    try:
+        for chunk in iter(lambda: f.read(65536), ''):
+            h.update(chunk)
+    finally:
+        f.close()
+    return h.hexdigest()
+
+
+def build_fingerprint(settings, layout_path, assets=None):
+    """Calculates a fingerprint of everything but the sources that has
+    an effect on the output: the settings, the layout templates and the
+    names of the fingerprinted static files. The layout static files are
+    left out otherwise, as they are just copied.
+
+    A manifest with a different fingerprint can't be trusted and a full
+    build is needed.
+
+    :param settings: the settings module
+    :param layout_path: the path of the layout in use
+    :param assets: the assets manifest, see oak.assets, or None
+
+    :returns: string
+    """
+    h = hashlib.sha1()
+    h.update(str(MANIFEST_VERSION))
+    if assets:
+        h.update(repr(sorted(assets.items())))
+    for k in sorted(dir(settings)):
+        if k.isupper() and k not in VOLATILE_SETTINGS:
+            h.update(repr((k, getattr(settings, k))))
+    for root, dirs, files in os.walk(layout_path):
+        if root == layout_path and settings.STATIC_PATH in dirs:
+            dirs.remove(settings.STATIC_PATH)
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            st = os.stat(path)
+            h.update(repr((os.path.relpath(path, layout_path), st.st_mtime, st.st_size)))
+    return h.hexdigest()
+
+
+class Manifest(object):
+    """The persistent record of a previous build.
+
+    Every source is stored as a dict with the keys:
+
+    * mtime, size, hash: the state of the source when it was rendered
+    * outputs: the list of files generated from the source
+    * post: the rendered post, without its raw contents, or its summary
+
+    The git revision the build generated is kept in revision, None when
+    the sources weren't all committed or the build didn't tell.
+
+    """
+
+    def __init__(self, path, fingerprint=None):
+        """Initializes an empty manifest
+
+        :param path: the file the manifest is stored in
+        :param fingerprint: the fingerprint of the current build, see build_fingerprint
+        """
+        self.path = path
+        self.fingerprint = fingerprint
+        self.sources = {}
+        self.revision = None
+        self.loaded = False
+
+    def load(self):
+        """Loads the manifest from disk.
+
+        Nothing is loaded when the file does not exist, can't be read or
+        was written by a build with another fingerprint.
+
+        :returns: True if the stored manifest is usable
+        """
+        self.sources = {}
+        self.revision = None
+        self.loaded = False
+        if not os.path.exists(self.path):
+            return False
+        try:
+            f = open(self.path, 'rb')
+            try:
+                data = pickle.load(f)
+            finally:
+                f.close()
+        except Exception:
+            return False
+        if data.get('version') != MANIFEST_VERSION or data.get('fingerprint') != self.fingerprint:
+            return False
+        self.sources = data['sources']
+        self.revision = data['revision']
+        self.loaded = True
+        return True
+
+    def save(self):
+        """Writes the manifest to disk, replacing the previous one atomically
+        """
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp = "%s.tmp" % (self.path,)
+        f = open(tmp, 'wb')
+        try:
+            pickle.dump({
+                'version': MANIFEST_VERSION,
+                'fingerprint': self.fingerprint,
+                'sources': self.sources,
+                'revision': self.revision,
+            }, f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        os.rename(tmp, self.path)
+        self.loaded = True
+
+    def is_fresh(self, source):
+        """Checks whether `source` is unchanged since it was recorded and
+        its outputs are still in place.
+
+        mtime and size are checked first; when only the mtime differs the
+        content hash decides, so touching a file does not trigger a render.
+
+        :param source: the path of the source file
+
+        :returns: bool
+        """
+        entry = self.sources.get(source)
+        if entry is None:
+            return False
+        try:
+            st = os.stat(source)
+        except OSError:
+            return False
+        if st.st_size != entry['size']:
+            return False
+        if st.st_mtime != entry['mtime']:
+            if file_digest(source) != entry['hash']:
+                return False
+            entry['mtime'] = st.st_mtime
+        for output in entry['outputs']:
+            if not os.path.exists(output):
+                return False
+        return True
+
+    def get(self, source):
+        """Returns the stored post for `source`, or None
+        """
+        entry = self.sources.get(source)
+        if entry is None:
+            return None
+        return entry['post']
+
+    def record(self, source, post, outputs):
+        """Records the current state of `source` once it has been rendered
+
+        :param source: the path of the source file
+        :param post: the rendered post or its summary
+        :param outputs: the list of files generated from the source
+        """
+        st = os.stat(source)
+        stored = dict(post)
+        stored.pop('raw', None)
+        self.sources[source] = {
+            'mtime': st.st_mtime,
+            'size': st.st_size,
+            'hash': file_digest(source),
+            'outputs': list(outputs),
+            'post': stored,
+        }
+
+    def forget(self, source):
+        """Removes `source` from the manifest
+
+        :returns: the removed entry, or None
+        """
+        return self.sources.pop(source, None)
+
+    def removed(self, sources):
+        """Lists the recorded sources which are not in `sources` anymore
+
+        :param sources: the list of current sources
+
+        :returns: list
+        """
+        current = set(sources)
+        return [s for s in self.sources.keys() if s not in current]
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""Oak build metrics
+
+Counters and timers of a generation, which tools can follow as they
+change instead of parsing the log. Every change is an event, a dict with
+at least the keys type ('counter', 'timer' or 'event'), name and time,
+sent to the subscribed callables:
+
+    def on_event(event):
+        if event['name'] == 'written':
+            print event['path']
+
+    my_oak.metrics.subscribe(on_event)
+
+The counters oak keeps are:
+
+* written, skipped: the files written, and those left untouched as they
+  didn't change. Events of single files have their path
+* bytes_written: the bytes written
+* copied: the static files copied
+* pages: the pages rendered, with their kind (post, tag, index, ...)
+
+And the timers:
+
+* generate: the whole generation
+* phase: each generation phase, named in the phase key
+* render: the rendering of each page, with its kind
+
+Listing pages are rendered by several threads at once, so the counters
+are updated and the events sent while holding a lock.
+
+"""
+
+import json
+import threading
+import time
+
+
+class _Timer(object):
+    def __init__(self, metrics, name, fields):
+        self.metrics = metrics
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.timing(self.name, time.time() - self.start, **self.fields)
+        return False
+
+
+class Metrics(object):
+    """Keeps the counters and timers of a generation and sends every
+    change to the subscribers.
+
+    """
+
+    def __init__(self, counters=()):
+        """Initializes the metrics
+
+        :param counters: the names of the counters starting at 0
+        """
+        self.subscribers = []
+        self.lock = threading.RLock()
+        self.reset(counters)
+
+    def reset(self, counters=()):
+        """Sets every counter and timer back to 0
+
+        :param counters: the names of the counters starting at 0
+        """
+        self.counters = dict((name, 0) for name in counters)
+        self.timers = {}
+
+    def subscribe(self, callback):
+        """Calls `callback` with every event from now on
+        """
+        self.subscribers.append(callback)
+
+    def _emit(self, event):
+        if self.subscribers:
+            event['time'] = time.time()
+            for callback in self.subscribers:
+                callback(event)
+
+    def incr(self, name, value=1, **fields):
+        """Adds `value` to the counter `name`
+
+        :param fields: more data about the change, sent with the event
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            if self.subscribers:
+                fields.update(type='counter', name=name, value=value, total=self.counters[name])
+                self._emit(fields)
+
+    def timing(self, name, seconds, **fields):
+        """Records that something timed by `name` took `seconds`
+
+        :param fields: more data about what was timed, sent with the event
+        """
+        with self.lock:
+            count, total = self.timers.get(name, (0, 0.0))
+            self.timers[name] = (count + 1, total + seconds)
+            if self.subscribers:
+                fields.update(type='timer', name=name, seconds=seconds)
+                self._emit(fields)
+
+    def timer(self, name, **fields):
+        """Times the code inside, use it as a context manager
+        """
+        return _Timer(self, name, fields)
+
+    def event(self, name, **fields):
+        """Sends an event which is neither a counter nor a timer
+        """
+        with self.lock:
+            if self.subscribers:
+                fields.update(type='event', name=name)
+                self._emit(fields)
+
+
+class JSONLinesWriter(object):
+    """A subscriber writing every event as a line of JSON to a file"""
+
+    def __init__(self, f):
+        """:param f: the file object to write to"""
+        self.f = f
+
+    def __call__(self, event):
+        self.f.write(json.dumps(event, sort_keys=True, default=str) + '\n')
+        self.f.flush()
@@ -1,18 +1,23 @@
 # -*- coding: utf-8 -*-
 
 import os
-import yaml
 import codecs
 
-from oak.utils import Atom
-import oak.processors as procs
+import yaml
+
+from oak import profiler
+from oak.utils import Atom, excerpt, parse_date
+from oak.utils.frontmatter import parse_header
+from oak.processors.processor import get_processor
 
 HEADER_MARK = '---'
 
 class PostError(Exception):
     """Custom exception for invalid posts."""
-    def __init__(self, msg):
+    def __init__(self, msg, source=None):
+        Exception.__init__(self, "%s: %s" % (source, msg) if source else msg)
         self.msg = msg
+        self.source = source
 
 
 class Post(dict):
@@ -41,9 +46,19 @@ class Post(dict):
     header start and end.
 
     """
+    # Keys read or processed the first time they are accessed, see load
+    LAZY_KEYS = ('raw', 'html', 'excerpt')
+
+    _source = None
+    _processor = None
+    _excerpt_length = 200
+
     def __init__(self, f, url, settings, processor=None):
         """The Post class __init__
 
+        Only the header is read here. The body is read, and processed, the
+        first time the 'raw', 'html' or 'excerpt' keys are accessed.
+
         :param f: the path to the post file
         :param settings: the blog settings
         :param processor: the processor to render post's contents
@@ -51,25 +66,27 @@ class Post(dict):
 
         :raises: PostError
         """
-        try:
-            _f = codecs.open(f, mode='r', encoding='utf-8')
-        except:
-            raise PostError('Unable to open file. Hint: isn\'t it UTF-8 encoded?')
-        
+        self._source = f
+        self._processor = processor
+        self._excerpt_length = settings.EXCERPT_LENGTH
+
         metadata = settings.POST_DEFAULTS
 
         # Set metadata to the app defaults
         self['metadata'] = metadata.copy()
-        self.f = _f.read()
-        if not self.f.startswith(HEADER_MARK):
-            raise PostError('Post file invalid, no header found.')
-        _, metadata, self['raw'] = self.f.split(HEADER_MARK, 2)
+        metadata = self._read_header()
         # update the metadata with the header's contents
-        self['metadata'].update(yaml.load(metadata))
-        # TODO auto determine processor based on metadata['markup']
-        if processor:
-            p = processor()
-            self = p.process(self)
+        with profiler.get_active().span('yaml'):
+            try:
+                self['metadata'].update(parse_header(metadata, settings.FAST_HEADERS))
+            except (yaml.YAMLError, ValueError), e:
+                raise PostError("Invalid header: %s" % (e,), f)
+        if 'pub_date' in self['metadata']:
+            # templates and listings get a datetime, whatever the header has
+            try:
+                self['metadata']['pub_date'] = parse_date(self['metadata']['pub_date'])
+            except ValueError:
+                raise PostError('Invalid pub_date, it must be like 2010-05-02 17:00:00.', f)
 
         # Partial refactoring
         filename = os.path.basename(f)
@@ -80,6 +97,105 @@ class Post(dict):
         self['url'] = "%s%s" % (url, self._post_url(name))
         self['id'] = Atom.gen_id(self)
 
+    def _open(self):
+        try:
+            return codecs.open(self._source, mode='r', encoding='utf-8')
+        except:
+            raise PostError('Unable to open file. Hint: isn\'t it UTF-8 encoded?', self._source)
+
+    def _read_header(self):
+        """Reads the file up to the end of the header, leaving the body
+        unread.
+
+        :returns: the header, without the marks
+        :raises: PostError
+        """
+        with profiler.get_active().span('read'):
+            _f = self._open()
+            try:
+                text = u''
+                for line in _f:
+                    if not text and not line.startswith(HEADER_MARK):
+                        raise PostError('Post file invalid, no header found.', self._source)
+                    text += line
+                    if text.count(HEADER_MARK) >= 2:
+                        break
+            finally:
+                _f.close()
+        if not text.startswith(HEADER_MARK):
+            raise PostError('Post file invalid, no header found.', self._source)
+        parts = text.split(HEADER_MARK, 2)
+        if len(parts) < 3:
+            raise PostError('Post file invalid, the header is not closed.', self._source)
+        return parts[1]
+
+    def _read_body(self):
+        """Reads the body of the post into 'raw'
+        """
+        with profiler.get_active().span('read'):
+            _f = self._open()
+            try:
+                self['raw'] = _f.read().split(HEADER_MARK, 2)[2]
+            finally:
+                _f.close()
+
+    def _process(self):
+        """Processes the body of the post into 'html'
+        """
+        # TODO auto determine processor based on metadata['markup']
+        if self._processor:
+            if 'raw' not in self:
+                self._read_body()
+            p = get_processor(self._processor)
+            with profiler.get_active().span('markdown'):
+                p.cached_process(self)
+
+    def __missing__(self, key):
+        if key not in self.LAZY_KEYS or self._source is None:
+            raise KeyError(key)
+        if key == 'raw':
+            self._read_body()
+        elif key == 'html':
+            self._process()
+            if 'html' not in self:
+                # nothing to process
+                raise KeyError(key)
+        elif key == 'excerpt':
+            self['excerpt'] = excerpt(self.get_lazy('html') or self['raw'], self._excerpt_length)
+        return dict.__getitem__(self, key)
+
+    def get_lazy(self, key, default=None):
+        """Like get, but reading or processing the lazy keys if needed
+        """
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def load(self):
+        """Reads and processes the body now, if it wasn't yet, so every
+        key is set, as needed before copying or pickling the post.
+
+        :returns: the post itself
+        """
+        for key in self.LAZY_KEYS:
+            self.get_lazy(key)
+        return self
+
+    @classmethod
+    def restore(cls, data):
+        """Builds a post from a previously rendered one, without reading
+        or processing its source again.
+
+        :param data: the dict of a rendered post, as stored in the manifest
+        :type data: dict
+
+        :returns: Post
+        """
+        post = cls.__new__(cls)
+        post.update(data)
+        return post
+
     def _post_url(self, name):
         """Calculates the URL of a post given a name
 
@@ -104,4 +220,32 @@ class Post(dict):
         newfilename = "%s.html" % name
         return os.path.sep.join([output_path, year, month, newfilename])
 
-       
+
+class PostSummary(dict):
+    """
+    A lightweight stand-in for an already rendered post, used in low
+    memory mode. It holds the post metadata, url, id, output path, excerpt
+    and related posts, but not its raw contents nor its HTML.
+
+    The HTML is loaded again by calling `loader` each time the 'html' key
+    is accessed, and is not kept.
+
+    """
+
+    KEYS = ('metadata', 'url', 'id', 'output_path', 'excerpt', 'related')
+
+    def __init__(self, post, loader=None):
+        """The PostSummary __init__
+
+        :param post: the rendered post, or a previous summary
+        :param loader: a callable returning the HTML of the post
+        """
+        for k in self.KEYS:
+            if k in post:
+                self[k] = post[k]
+        self.loader = loader
+
+    def __missing__(self, key):
+        if key == 'html' and self.loader is not None:
+            return self.loader()
+        raise KeyError(key)
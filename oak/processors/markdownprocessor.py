@@ -39,13 +39,54 @@ INLINESTYLES = True
 
 
 import re
+import threading
 
 from markdown.preprocessors import Preprocessor
 
+import pygments
 from pygments import highlight
 from pygments.formatters import HtmlFormatter
 from pygments.lexers import get_lexer_by_name, TextLexer
 
+from oak import profiler
+from oak.utils.cache import cache_key
+
+# The DiskCache holding already highlighted code blocks of the calling thread,
+# see use_highlight_cache
+_highlight_cache = threading.local()
+
+# Lexers and formatters are built once per process
+_lexers = {}
+_formatters = {}
+
+
+def use_highlight_cache(cache):
+    """Sets the DiskCache the code blocks highlighted by the calling
+    thread go through, None to disable it. Oak sets it up from the
+    HIGHLIGHT_CACHE settings, see processor.use_caches.
+    """
+    _highlight_cache.cache = cache
+
+
+def get_lexer(name):
+    """Returns the lexer for the language `name`, TextLexer if unknown
+    """
+    if name not in _lexers:
+        try:
+            _lexers[name] = get_lexer_by_name(name)
+        except ValueError:
+            _lexers[name] = TextLexer()
+    return _lexers[name]
+
+
+def get_formatter(**options):
+    """Returns the HtmlFormatter for the given options
+    """
+    key = tuple(sorted(options.items()))
+    if key not in _formatters:
+        _formatters[key] = HtmlFormatter(**options)
+    return _formatters[key]
+
 
 class CodeBlockPreprocessor(Preprocessor):
 
@@ -55,13 +96,23 @@ class CodeBlockPreprocessor(Preprocessor):
 
     def run(self, lines):
         def repl(m):
-            try:
-                lexer = get_lexer_by_name(m.group(1))
-            except ValueError:
-                lexer = TextLexer()
-            formatter = HtmlFormatter(noclasses=INLINESTYLES)
+            with profiler.get_active().span('pygments'):
+                return highlight_block(m)
+        def highlight_block(m):
+            options = {'noclasses': INLINESTYLES}
+            highlight_cache = getattr(_highlight_cache, 'cache', None)
+            if highlight_cache is not None:
+                key = cache_key(pygments.__version__, m.group(1), sorted(options.items()), m.group(2))
+                cached = highlight_cache.get(key)
+                if cached is not None:
+                    return cached.decode('utf-8')
+            lexer = get_lexer(m.group(1))
+            formatter = get_formatter(**options)
             code = highlight(m.group(2), lexer, formatter)
             code = code.replace('\n\n', '\n&nbsp;\n')
-            return '\n\n<div class="code">%s</div>\n\n' % code
+            block = '\n\n<div class="code">%s</div>\n\n' % code
+            if highlight_cache is not None:
+                highlight_cache.set(key, block.encode('utf-8'))
+            return block
         return self.pattern.sub(
             repl, '\n'.join(lines)).split('\n')
@@ -1,14 +1,73 @@
 # -*- coding: utf-8 -*-
 
+import markdownprocessor
 from markdownprocessor import CodeBlockPreprocessor
 
+import threading
+
 import markdown
+import pygments
+
+from oak.utils.cache import cache_key
+
+# The shared instances of the reusable processors, see get_processor
+_instances = threading.local()
+
+# The caches of the calling thread, see use_caches
+_caches = threading.local()
+
+def use_caches(html_cache=None, highlight_cache=None):
+    """Sets the caches the posts processed by the calling thread go
+    through, oak sets them up from the HTML_CACHE and HIGHLIGHT_CACHE
+    settings. Every thread has its own, so Oak instances generating from
+    different threads don't share them.
+
+    :param html_cache: the DiskCache holding the HTML of already processed
+        posts, None to disable it
+    :param highlight_cache: the DiskCache holding already highlighted code
+        blocks, None to disable it
+    """
+    _caches.html = html_cache
+    markdownprocessor.use_highlight_cache(highlight_cache)
+
+def get_html_cache():
+    """Returns the HTML cache of the calling thread, see use_caches
+    """
+    return getattr(_caches, 'html', None)
+
+def get_processor(cls):
+    """Returns an instance of the processor class `cls`.
+
+    Reusable processors are instantiated once per thread (listing pages are
+    rendered by several of them) and per worker process, and that instance
+    is returned from then on. Other processors get a new instance on every
+    call.
+
+    :param cls: the processor class
+    :type cls: class
+
+    :returns: Processor
+    """
+    if not cls.reusable:
+        return cls()
+    if not hasattr(_instances, 'processors'):
+        _instances.processors = {}
+    instances = _instances.processors
+    if cls not in instances:
+        instances[cls] = cls()
+    return instances[cls]
 
 class Processor(object):
     """This class is the one responsible for processing the posts sources
     and generate the resulting HTML code.
+
+    Subclasses which keep no per-post state between calls to `process`
+    can set `reusable` to True to have a single instance shared by all the
+    posts, see get_processor.
     """
 
+    reusable = False
+
     def process(self, post):
         """This method is responsible of processing the post's markup into HTML.
 
@@ -22,18 +81,78 @@ class Processor(object):
         """
         return post
 
+    def options(self):
+        """Returns what, besides the post's raw content, determines the
+        resulting HTML.
+
+        It's part of the key of the cached HTML, so subclasses with options
+        of their own must extend it to have the cache invalidated when
+        they change.
+
+        :returns: tuple
+        """
+        return (self.__class__.__module__, self.__class__.__name__)
+
+    def cached_process(self, post):
+        """Processes the post unless its HTML is found in the html cache.
+
+        :param post: the dict with the post to process
+        :returns: dict
+        """
+        html_cache = get_html_cache()
+        if html_cache is None or not post.get('raw'):
+            return self.process(post)
+        key = cache_key(self.options(), post['raw'])
+        html = html_cache.get(key)
+        if html is not None:
+            post['html'] = html.decode('utf-8')
+            return post
+        post = self.process(post)
+        if post.get('html') is not None:
+            html_cache.set(key, post['html'].encode('utf-8'))
+        return post
+
+    def process_many(self, posts):
+        """Processes a batch of posts in one call, using the html cache.
+
+        :param posts: the list of post dicts to process
+        :returns: list
+        """
+        return [self.cached_process(post) for post in posts]
+
 class MarkdownProcessor(Processor):
     """The markdown syntax processor for oak posts.
 
+    The Markdown converter is built on first use and reset between posts.
     """
 
+    reusable = True
+
+    def __init__(self):
+        self.md = None
+
+    def converter(self):
+        """Returns the Markdown converter, building it if needed.
+
+        :returns: markdown.Markdown
+        """
+        if self.md is None:
+            self.md = markdown.Markdown()
+            self.md.preprocessors.insert(0, 'text', CodeBlockPreprocessor())
+        return self.md
+
+    def options(self):
+        """The versions of Markdown and Pygments and the highlighting style
+        determine the HTML too.
+        """
+        return Processor.options(self) + (markdown.version, pygments.__version__, markdownprocessor.INLINESTYLES)
+
     def process(self, post):
         """The process method for Markdown posts.
 
         """
         if post.get('raw'):
-            md = markdown.Markdown()
-            md.preprocessors.insert(0, 'text', CodeBlockPreprocessor())
+            md = self.converter()
+            md.reset()
             post['html'] = md.convert(post.get('raw'))
         return post
-
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""Oak profiler
+
+Records where a generation spends its time: wall and CPU time of every
+phase, and for every post the time spent reading, parsing, converting,
+highlighting, rendering and writing it.
+
+The code being profiled reports to the active profiler of its thread,
+see get_active, which does nothing unless oak is run with --profile.
+Each thread times its own spans, so pages rendered by several threads
+at once are timed right.
+
+"""
+
+import json
+import os
+import threading
+import time
+
+# The parts a post's time is split into, in processing order
+POST_PARTS = ('read', 'yaml', 'markdown', 'pygments', 'render', 'write')
+
+
+def _cpu_time():
+    """Returns the CPU time used by the process and its finished children"""
+    t = os.times()
+    return t[0] + t[1] + t[2] + t[3]
+
+
+class _NullContext(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_null_context = _NullContext()
+
+
+class NullProfiler(object):
+    """A profiler which records nothing, at the least possible cost"""
+
+    enabled = False
+
+    def phase(self, name):
+        return _null_context
+
+    def post(self, source):
+        return _null_context
+
+    def span(self, part):
+        return _null_context
+
+    def post_timings(self, source):
+        return None
+
+    def add_post_timings(self, source, timings):
+        pass
+
+
+class _Phase(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.time()
+        self.cpu = _cpu_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.phases.append({
+            'name': self.name,
+            'wall': time.time() - self.wall,
+            'cpu': _cpu_time() - self.cpu,
+        })
+        return False
+
+
+class _Post(object):
+    def __init__(self, profiler, source):
+        self.profiler = profiler
+        self.source = source
+
+    def __enter__(self):
+        self.profiler._state().current = self.profiler.posts.setdefault(self.source, {})
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler._state().current = None
+        return False
+
+
+class _Span(object):
+    def __init__(self, profiler, part):
+        self.profiler = profiler
+        self.part = part
+
+    def __enter__(self):
+        self.children = 0.0
+        self.state = self.profiler._state()
+        self.state.stack.append(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.time() - self.start
+        stack = self.state.stack
+        stack.pop()
+        if stack:
+            # the parent span only accounts for its own time
+            stack[-1].children += elapsed
+        current = self.state.current
+        if current is not None:
+            current[self.part] = current.get(self.part, 0.0) + elapsed - self.children
+        return False
+
+
+class Profiler(NullProfiler):
+    """Records phase and per post timings.
+
+    Post parts are timed exclusively: the time spent highlighting code is
+    not counted again as Markdown conversion time.
+
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.phases = []
+        self.posts = {}
+        self._local = threading.local()
+
+    def _state(self):
+        """Returns the spans open in the calling thread and the timings of
+        the post they're attributed to, as the attributes stack and current
+        """
+        state = self._local
+        if not hasattr(state, 'stack'):
+            state.stack = []
+            state.current = None
+        return state
+
+    def phase(self, name):
+        """Times a generation phase, use it as a context manager
+        """
+        return _Phase(self, name)
+
+    def post(self, source):
+        """Attributes the spans inside to the post at `source`, use it as a
+        context manager
+        """
+        return _Post(self, source)
+
+    def span(self, part):
+        """Times one of the POST_PARTS of the current post, use it as a
+        context manager
+        """
+        return _Span(self, part)
+
+    def post_timings(self, source):
+        """Returns the timings recorded for the post at `source`
+        """
+        return self.posts.get(source)
+
+    def add_post_timings(self, source, timings):
+        """Adds the timings of a post recorded somewhere else, in a worker
+        process for instance
+        """
+        if timings:
+            post = self.posts.setdefault(source, {})
+            for part, elapsed in timings.items():
+                post[part] = post.get(part, 0.0) + elapsed
+
+    def totals(self):
+        """Returns the time spent in every part, summed over all the posts
+
+        :returns: dict
+        """
+        totals = dict((part, 0.0) for part in POST_PARTS)
+        for timings in self.posts.values():
+            for part, elapsed in timings.items():
+                totals[part] = totals.get(part, 0.0) + elapsed
+        return totals
+
+    def slowest(self, count=10):
+        """Returns the `count` posts which took the longest
+
+        :returns: a list of (source, total, timings) tuples
+        """
+        posts = [(source, sum(timings.values()), timings) for source, timings in self.posts.items()]
+        posts.sort(key=lambda p: p[1], reverse=True)
+        return posts[:count]
+
+    def as_dict(self):
+        """Returns everything recorded, ready to be dumped as JSON
+
+        :returns: dict
+        """
+        return {
+            'phases': self.phases,
+            'totals': self.totals(),
+            'posts': dict((source, dict(timings, total=sum(timings.values())))
+                          for source, timings in self.posts.items()),
+        }
+
+    def write_json(self, filename):
+        """Writes everything recorded as JSON to `filename`
+        """
+        f = open(filename, 'w')
+        try:
+            json.dump(self.as_dict(), f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+
+    def report(self, top=10):
+        """Returns a human readable report of the recorded timings
+
+        :param top: how many of the slowest posts to list
+
+        :returns: string
+        """
+        lines = ["%-16s %10s %10s" % ('phase', 'wall (s)', 'cpu (s)')]
+        for phase in self.phases:
+            lines.append("%-16s %10.3f %10.3f" % (phase['name'], phase['wall'], phase['cpu']))
+        lines.append('')
+        totals = self.totals()
+        lines.append("%d posts processed: %s" % (len(self.posts),
+            ', '.join("%s %.3fs" % (part, totals[part]) for part in POST_PARTS)))
+        if self.posts and top:
+            lines.append('')
+            lines.append("slowest posts (seconds):")
+            lines.append(' '.join(["%8s" % ('total',)] + ["%8s" % (part,) for part in POST_PARTS] + ['source']))
+            for source, total, timings in self.slowest(top):
+                lines.append(' '.join(["%8.3f" % (total,)] +
+                    ["%8.3f" % (timings.get(part, 0.0),) for part in POST_PARTS] + [source]))
+        return '\n'.join(lines)
+
+# The active profiler of every thread, see set_active
+_active = threading.local()
+
+_null_profiler = NullProfiler()
+
+
+def set_active(profiler):
+    """Makes `profiler` the one the code run by the calling thread
+    reports to, None for none
+    """
+    _active.profiler = profiler
+
+
+def get_active():
+    """Returns the profiler the calling thread reports to, a NullProfiler
+    if none is active
+    """
+    return getattr(_active, 'profiler', None) or _null_profiler
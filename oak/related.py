@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""Related posts
+
+Every post gets the posts most similar to it, judging by the tags and
+the words of the title they share. Posts are the rows of a sparse matrix
+of those features, weighted by how rare they are (their inverse document
+frequency) and normalized, so the similarity of two posts is the dot
+product of their rows, the cosine of their angle.
+
+The similarities are computed in blocks of rows with NumPy and SciPy if
+they're installed, which big blogs will want, and walking an inverted
+index of the features otherwise. Both give the same results: scores are
+rounded, and ties go to the post listed first.
+
+Features shared by more than half the posts tell them apart too little
+and would make the pure Python version slow, so they're left out. As
+the cutoff grows with the blog, common tags still relate the posts of
+big blogs; the work grows with the square of the posts sharing each
+feature though, so those will want NumPy.
+
+"""
+
+import heapq
+import math
+
+try:
+    import numpy
+    import scipy.sparse
+except ImportError:
+    numpy = None
+
+from oak.search import tokenize
+
+# A shared tag counts as much as this many shared title words
+TAG_WEIGHT = 2.0
+
+# The digits scores are rounded to
+SCORE_DIGITS = 6
+
+# The features of more than this share of the posts are left out
+MAX_SHARE = 0.5
+
+# The posts whose similarities SciPy computes at once, bounding the memory used
+BLOCK_ROWS = 1024
+
+
+def post_features(post):
+    """Lists the features of a post: its tags and the terms of its title,
+    as the search index has them
+
+    :returns: list
+    """
+    metadata = post['metadata']
+    features = set(u"tag:%s" % (unicode(t).lower(),) for t in metadata.get('tags') or [])
+    features.update(u"word:%s" % (w,) for w in tokenize(unicode(metadata.get('title') or u'')))
+    return sorted(features)
+
+
+def _weigh(features, max_share):
+    """Weighs the features of every post, see related
+
+    :returns: a list with a dict of weighted features per post
+    """
+    df = {}
+    for fs in features:
+        for f in fs:
+            df[f] = df.get(f, 0) + 1
+    n = float(len(features))
+    max_posts = n * max_share
+    rows = []
+    for fs in features:
+        row = {}
+        for f in fs:
+            if df[f] > 1 and df[f] <= max_posts:
+                row[f] = math.log(n / df[f]) * (TAG_WEIGHT if f.startswith(u'tag:') else 1.0)
+        norm = math.sqrt(sum(w * w for w in row.itervalues()))
+        rows.append(dict((f, w / norm) for f, w in row.iteritems()) if norm else {})
+    return rows
+
+
+def _related_python(rows, count):
+    postings = {}
+    for i, row in enumerate(rows):
+        for f, w in row.iteritems():
+            postings.setdefault(f, []).append((i, w))
+    result = []
+    for i, row in enumerate(rows):
+        scores = {}
+        for f, w in row.iteritems():
+            for j, v in postings[f]:
+                if j != i:
+                    scores[j] = scores.get(j, 0.0) + w * v
+        candidates = [(-round(s, SCORE_DIGITS), j) for j, s in scores.iteritems()]
+        result.append([(j, -s) for s, j in heapq.nsmallest(count, candidates) if s < 0])
+    return result
+
+
+def _related_numpy(rows, count):
+    vocabulary = {}
+    data, indices, indptr = [], [], [0]
+    for row in rows:
+        for f, w in sorted(row.iteritems()):
+            indices.append(vocabulary.setdefault(f, len(vocabulary)))
+            data.append(w)
+        indptr.append(len(indices))
+    n = len(rows)
+    matrix = scipy.sparse.csr_matrix((data, indices, indptr), shape=(n, max(1, len(vocabulary))))
+    transposed = matrix.T.tocsr()
+    result = []
+    for start in range(0, n, BLOCK_ROWS):
+        scores = matrix[start:start + BLOCK_ROWS] * transposed
+        scores.data = numpy.round(scores.data, SCORE_DIGITS)
+        for i in range(scores.shape[0]):
+            lo, hi = scores.indptr[i], scores.indptr[i + 1]
+            candidates, values = scores.indices[lo:hi], scores.data[lo:hi]
+            # a post is not related to itself
+            keep = (values > 0) & (candidates != start + i)
+            candidates, values = candidates[keep], values[keep]
+            if len(candidates) > count:
+                # keep those tied with the last one, the position decides
+                kth = numpy.partition(values, len(values) - count)[len(values) - count]
+                keep = values >= kth
+                candidates, values = candidates[keep], values[keep]
+            best = numpy.lexsort((candidates, -values))[:count]
+            result.append([(int(candidates[j]), float(values[j])) for j in best])
+    return result
+
+
+def related(features, count=5, max_share=MAX_SHARE):
+    """Finds the posts most related to each post
+
+    :param features: the features of every post, see post_features
+    :param count: the number of related posts to find for each post
+    :param max_share: the features of more than this share of the posts
+        are left out
+
+    :returns: a list with the (position, score) pairs of the related
+        posts of each post, the most related first
+    """
+    if not features or count <= 0:
+        return [[] for fs in features]
+    rows = _weigh(features, max_share)
+    if numpy is not None:
+        return _related_numpy(rows, count)
+    return _related_python(rows, count)
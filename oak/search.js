@@ -0,0 +1,134 @@
+/*
+ * Oak search client
+ *
+ * Searches the static index oak writes when GENERATE_SEARCH_INDEX is
+ * enabled (see oak/search.py), fetching only the shards holding the terms
+ * searched:
+ *
+ *     var search = new OakSearch('http://example.com/search');
+ *     search.query('static blogs').then(function (results) {
+ *         // [{url: ..., title: ..., date: ..., score: ...}, ...]
+ *     });
+ *
+ * The posts found contain every term of the query, the best scored first.
+ * Queries are split in terms the same way the posts were: the stopwords
+ * listed in the index are left out and the rest go through stem, which
+ * must match stem in oak/search.py.
+ */
+(function (root) {
+    'use strict';
+
+    var WORD_RE = /[\p{L}\p{N}_]+/gu;
+    var SAFE_RE = /^[a-z0-9]+$/;
+    var SUFFIXES = [['ies', 'y'], ['sses', 'ss'], ['ing', ''], ['ed', ''], ['ly', ''], ['s', '']];
+
+    function stem(word) {
+        for (var i = 0; i < SUFFIXES.length; i++) {
+            var suffix = SUFFIXES[i][0];
+            if (word.length - suffix.length >= 3 && word.slice(-suffix.length) === suffix) {
+                if (suffix === 's' && 'siu'.indexOf(word.charAt(word.length - 2)) >= 0) {
+                    return word;
+                }
+                return word.slice(0, -suffix.length) + SUFFIXES[i][1];
+            }
+        }
+        return word;
+    }
+
+    function shardName(term, length) {
+        var prefix = term.slice(0, length);
+        if (SAFE_RE.test(prefix)) {
+            return prefix;
+        }
+        var name = '_';
+        new TextEncoder().encode(prefix).forEach(function (b) {
+            name += (b < 16 ? '0' : '') + b.toString(16);
+        });
+        return name;
+    }
+
+    function OakSearch(url) {
+        this.url = url.replace(/\/$/, '');
+        this.index = null;
+        this.shards = {};
+    }
+
+    OakSearch.prototype.fetch = function (name) {
+        return fetch(this.url + '/' + name).then(function (response) {
+            if (!response.ok) {
+                throw new Error('Unable to fetch ' + name + ': ' + response.status);
+            }
+            return response.json();
+        });
+    };
+
+    OakSearch.prototype.load = function () {
+        if (!this.index) {
+            this.index = this.fetch('docs.json').then(function (index) {
+                index.stopwordSet = {};
+                index.stopwords.forEach(function (w) { index.stopwordSet[w] = true; });
+                index.shardSet = {};
+                index.shards.forEach(function (s) { index.shardSet[s] = true; });
+                return index;
+            });
+        }
+        return this.index;
+    };
+
+    OakSearch.prototype.terms = function (text, index) {
+        var terms = [];
+        (text.toLowerCase().match(WORD_RE) || []).forEach(function (word) {
+            if (word.length > 1 && !index.stopwordSet.hasOwnProperty(word)) {
+                var term = stem(word);
+                if (terms.indexOf(term) < 0) {
+                    terms.push(term);
+                }
+            }
+        });
+        return terms;
+    };
+
+    OakSearch.prototype.postings = function (term, index) {
+        var name = shardName(term, index.prefix);
+        if (!index.shardSet.hasOwnProperty(name)) {
+            return Promise.resolve([]);
+        }
+        if (!this.shards[name]) {
+            this.shards[name] = this.fetch(name + '.json');
+        }
+        return this.shards[name].then(function (shard) {
+            return shard.hasOwnProperty(term) ? shard[term] : [];
+        });
+    };
+
+    OakSearch.prototype.query = function (text) {
+        var self = this;
+        return this.load().then(function (index) {
+            var terms = self.terms(text, index);
+            return Promise.all(terms.map(function (term) {
+                return self.postings(term, index);
+            })).then(function (postings) {
+                var scores = {}, matches = {}, results = [];
+                postings.forEach(function (list) {
+                    // postings are flat (post number, frequency) pairs
+                    var idf = Math.log(1 + index.docs.length / Math.max(1, list.length / 2));
+                    for (var i = 0; i < list.length; i += 2) {
+                        scores[list[i]] = (scores[list[i]] || 0) + list[i + 1] * idf;
+                        matches[list[i]] = (matches[list[i]] || 0) + 1;
+                    }
+                });
+                Object.keys(scores).forEach(function (n) {
+                    if (matches[n] === terms.length) {
+                        var doc = index.docs[n];
+                        results.push({url: doc[0], title: doc[1], date: doc[2], score: scores[n]});
+                    }
+                });
+                results.sort(function (a, b) { return b.score - a.score; });
+                return results;
+            });
+        });
+    };
+
+    OakSearch.stem = stem;
+    root.OakSearch = OakSearch;
+})(this);
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""Static search index
+
+The posts are indexed into a set of JSON files the browser can search
+without a server, see search.js. The index is written under its own
+directory:
+
+* docs.json: the indexed posts, as [url, title, date] lists, along with
+  what the client needs to handle the queries the same way: the length
+  of the shard prefixes, the stopwords and the list of shards.
+* one file per shard: the terms starting with the same prefix, each one
+  mapped to a flat list of (post number, term frequency) pairs. A query
+  only fetches the shards of its terms.
+
+Terms are the lowercased words of the title, the tags and the text of
+the body, but the stopwords, reduced by a light stemmer (see stem) which
+search.js implements too.
+
+Postings are kept in memory up to a limit and spilled to temporary
+files beyond it, and the shards are then built one at a time, so big
+blogs can be indexed with bounded memory.
+
+"""
+
+import json
+import os
+import re
+import shutil
+import tempfile
+
+from oak.utils import plain_text
+
+# The version of the index format and of the way terms are extracted
+SEARCH_VERSION = 1
+
+# The name of the file listing the indexed posts, under the index path
+DOCS_NAME = 'docs.json'
+
+# The words too common to be worth indexing
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been
+before being below between both but by can could did do does doing down during
+each few for from further had has have having he her here hers herself him
+himself his how i if in into is it its itself just me more most my myself no nor
+not now of off on once only or other our ours ourselves out over own same she
+should so some such than that the their theirs them themselves then there these
+they this those through to too under until up very was we were what when where
+which while who whom why will with would you your yours yourself yourselves
+""".split())
+
+# Title and tag words count as much as this many words of the body
+TITLE_WEIGHT = 5
+
+# The postings kept in memory before spilling them to disk
+MAX_BUFFERED = 200000
+
+_WORD_RE = re.compile(r'\w+', re.U)
+_SAFE_RE = re.compile(r'^[a-z0-9]+$')
+
+# (suffix, replacement) pairs, the first one matching is applied
+_SUFFIXES = (
+    (u'ies', u'y'),
+    (u'sses', u'ss'),
+    (u'ing', u''),
+    (u'ed', u''),
+    (u'ly', u''),
+    (u's', u''),
+)
+
+
+def stem(word):
+    """Strips the most common English suffix of `word`, leaving at least 3
+    characters. It's no Porter stemmer, but it's simple enough to be done
+    the same way by the browser.
+
+    :returns: string
+    """
+    for suffix, replacement in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            if suffix == u's' and word[-2] in u'siu':
+                # class, analysis, status
+                return word
+            return word[:-len(suffix)] + replacement
+    return word
+
+
+def tokenize(text, stopwords=STOPWORDS):
+    """Splits `text` in terms, leaving the stopwords and the single
+    characters out
+
+    :returns: list
+    """
+    return [stem(w) for w in _WORD_RE.findall(text.lower())
+            if len(w) > 1 and w not in stopwords]
+
+
+def post_terms(post, stopwords=STOPWORDS):
+    """Counts the terms of a post
+
+    :param post: the post, its HTML is loaded if needed
+    :returns: a dict mapping the terms to their frequency
+    """
+    terms = {}
+    metadata = post['metadata']
+    heading = u' '.join([unicode(metadata.get('title') or u'')] + [unicode(t) for t in metadata.get('tags') or []])
+    for term in tokenize(heading, stopwords):
+        terms[term] = terms.get(term, 0) + TITLE_WEIGHT
+    try:
+        html = post['html']
+    except KeyError:
+        html = None
+    # the whole body as plain text
+    for term in tokenize(plain_text(html), stopwords):
+        terms[term] = terms.get(term, 0) + 1
+    return terms
+
+
+def shard_name(term, prefix_length):
+    """Returns the name of the shard holding `term`: its prefix if it's
+    made of ASCII letters and digits, the UTF-8 bytes of the prefix in hex
+    after an underscore otherwise.
+
+    :returns: string
+    """
+    prefix = term[:prefix_length]
+    if _SAFE_RE.match(prefix):
+        return str(prefix)
+    return '_' + prefix.encode('utf-8').encode('hex')
+
+
+class SearchIndex(object):
+    """Builds the search index of a set of posts"""
+
+    def __init__(self, prefix_length=2, stopwords=STOPWORDS, tmpdir=None):
+        """Initializes an empty index
+
+        :param prefix_length: the length of the prefix shards are split by
+        :param stopwords: the words left out of the index
+        :param tmpdir: where to spill the postings, the system default if None
+        """
+        self.prefix_length = prefix_length
+        self.stopwords = stopwords
+        self.tmpdir = tmpdir
+        self.docs = []
+        self.buffers = {}
+        self.buffered = 0
+        self.spill_path = None
+
+    def add(self, doc, terms):
+        """Adds a post to the index
+
+        :param doc: the [url, title, date] list of the post
+        :param terms: the terms of the post and their frequency, see post_terms
+        """
+        number = len(self.docs)
+        self.docs.append(doc)
+        for term, tf in terms.iteritems():
+            self.buffers.setdefault(shard_name(term, self.prefix_length), []).append((term, number, tf))
+        self.buffered += len(terms)
+        if self.buffered >= MAX_BUFFERED:
+            self._spill()
+
+    def _spill(self):
+        if self.spill_path is None:
+            self.spill_path = tempfile.mkdtemp(prefix='search', dir=self.tmpdir)
+        for shard, postings in self.buffers.iteritems():
+            f = open(os.path.join(self.spill_path, shard), 'ab')
+            try:
+                for term, number, tf in postings:
+                    f.write("%s\t%d\t%d\n" % (term.encode('utf-8'), number, tf))
+            finally:
+                f.close()
+        self.buffers = {}
+        self.buffered = 0
+
+    def _postings(self, shard):
+        """Returns the postings of `shard`, spilled or not, by term
+
+        :returns: dict
+        """
+        terms = {}
+        if self.spill_path is not None and os.path.exists(os.path.join(self.spill_path, shard)):
+            f = open(os.path.join(self.spill_path, shard), 'rb')
+            try:
+                for line in f:
+                    term, number, tf = line.rstrip('\n').split('\t')
+                    terms.setdefault(term.decode('utf-8'), []).extend((int(number), int(tf)))
+            finally:
+                f.close()
+        for term, number, tf in self.buffers.get(shard, ()):
+            terms.setdefault(term, []).extend((number, tf))
+        return terms
+
+    def shards(self):
+        """Returns the names of the shards
+
+        :returns: list
+        """
+        names = set(self.buffers)
+        if self.spill_path is not None:
+            names.update(os.listdir(self.spill_path))
+        return sorted(names)
+
+    def files(self):
+        """Builds the files of the index, one shard at a time, and removes
+        the spilled postings once done.
+
+        :returns: an iterator over (file name, JSON data) tuples
+        """
+        shards = self.shards()
+        try:
+            yield DOCS_NAME, json.dumps({
+                'version': SEARCH_VERSION,
+                'prefix': self.prefix_length,
+                'stopwords': sorted(self.stopwords),
+                'shards': shards,
+                'docs': self.docs,
+            }, sort_keys=True, separators=(',', ':'))
+            for shard in shards:
+                yield "%s.json" % (shard,), json.dumps(self._postings(shard), sort_keys=True, separators=(',', ':'))
+        finally:
+            if self.spill_path is not None:
+                shutil.rmtree(self.spill_path, ignore_errors=True)
+                self.spill_path = None
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""Oak development server
+
+A tiny HTTP server to preview the generated site locally. It's not meant
+to publish the blog, use a real web server for that.
+
+"""
+
+import os
+import threading
+import BaseHTTPServer
+import SimpleHTTPServer
+
+
+class SiteRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    """Serves the files under `root` instead of the current directory"""
+
+    root = '.'
+    logger = None
+
+    def translate_path(self, path):
+        path = SimpleHTTPServer.SimpleHTTPRequestHandler.translate_path(self, path)
+        return os.path.join(self.root, os.path.relpath(path, os.getcwd()))
+
+    def log_message(self, format, *args):
+        if self.logger:
+            self.logger.debug("%s - " + format, self.address_string(), *args)
+
+
+def serve(root, port=8000, host='localhost', logger=None):
+    """Serves `root` over HTTP from a background thread
+
+    :param root: the directory to serve
+    :param port: the port to listen on
+    :param host: the address to listen on
+
+    :returns: the server, call its shutdown method to stop it
+    """
+    class Handler(SiteRequestHandler):
+        pass
+    Handler.root = os.path.abspath(root)
+    Handler.logger = logger
+    server = BaseHTTPServer.HTTPServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
@@ -37,9 +37,85 @@ POST_FILE_FORMAT = "%Y-%m-%s.html"
 # It will serve as the name for layout-relative static files (i.e.: layouts/foo/static)
 STATIC_PATH = 'static'
 
+# Set to True to write a copy of the static files with the extensions below
+# named after a hash of their contents (css/main.css -> css/main.3f2a1c9e.css).
+# Templates link to them with {{ asset('css/main.css') }}, and so does
+# links.css. Those copies never change, so they can be served with far-future
+# cache headers. The original files are kept
+ASSET_HASHING = True
+ASSET_EXTENSIONS = ('.css', '.js')
+
+# Set to True to minify the hashed copies of CSS and JavaScript files. rcssmin
+# and rjsmin are used if installed, otherwise CSS is minified by oak and
+# JavaScript left as is
+ASSET_MINIFY = False
+
 # Set the path where the output will be generated
 OUTPUT_PATH = 'site'
 
+# Set the path where oak keeps its build state (manifest, caches), relative to the
+# project directory. You may want to add it to your .gitignore
+CACHE_PATH = '.oak'
+
+# Set to True to only re-render the posts that changed since the last build and
+# the pages listing them. Can also be enabled with --incremental
+INCREMENTAL = False
+
+# Set to True to keep the HTML of the processed posts under CACHE_PATH, so
+# unchanged posts are not processed again on later generations
+HTML_CACHE = True
+
+# Set the maximum size in bytes of the processed posts cache, the least recently
+# used entries are evicted when it grows bigger. None for no limit
+HTML_CACHE_SIZE = 100 * 1024 * 1024
+
+# Set to True to keep the code blocks highlighted by Pygments under CACHE_PATH,
+# so they are not highlighted again on later generations
+HIGHLIGHT_CACHE = True
+
+# Set the maximum size in bytes of the highlighted code blocks cache, the least
+# recently used blocks are evicted when it grows bigger. None for no limit
+HIGHLIGHT_CACHE_SIZE = 50 * 1024 * 1024
+
+# Set to True to keep the compiled layout templates under CACHE_PATH, so they
+# are not compiled again every time oak starts
+TEMPLATE_CACHE = True
+
+# Set to True to keep only a summary of each post once it's rendered, loading its
+# body again when a listing page needs it. Memory usage then stays about the same
+# no matter how many posts the blog has. Can also be enabled with --low-memory
+LOW_MEMORY = False
+
+# Set to True to write the generated files from a background thread, so pages are
+# rendered while the previous ones are written. WRITE_QUEUE_SIZE files wait to be
+# written at most, and with FSYNC they're flushed to disk before the generation ends
+ASYNC_WRITES = True
+WRITE_QUEUE_SIZE = 64
+WRITE_BATCH_SIZE = 16
+FSYNC = False
+
+# Set the maximum length of the plain text excerpt of each post, available to the
+# templates as post.excerpt
+EXCERPT_LENGTH = 200
+
+# Set to True to parse the simple post headers, made of 'key: value' lines with
+# quoted strings, dates and lists, without going through YAML. Headers which
+# are not that simple are always parsed as YAML
+FAST_HEADERS = True
+
+# Set how many processes render posts in parallel, and how many threads render
+# the tag, author, index, archive and feed pages. Can also be set with --jobs
+JOBS = 1
+
+# Set to True to write a gzip compressed copy (file.html.gz) of every generated
+# file with one of these extensions, for web servers serving precompressed files
+# like nginx with gzip_static. Also a brotli one (file.html.br) if the brotli
+# module is installed and PRECOMPRESS_BROTLI is True. Can also be enabled with
+# --precompress
+PRECOMPRESS = False
+PRECOMPRESS_EXTENSIONS = ('.html', '.xml', '.css', '.js', '.json')
+PRECOMPRESS_BROTLI = True
+
 # Set the path to the layouts directory, the default is OK if you are using the installed oak package
 # Use an ABSOLUTE path if you want to point a custom location
 LAYOUTS_PATH = 'layouts'
@@ -50,6 +126,20 @@ DEFAULT_LAYOUT = 'default'
 # Set how many posts will be shown in the frontpage, set it to None to show them all
 POSTS_COUNT = 10
 
+# Set to True to list the older posts in further index pages (page/2.html, ...)
+# of POSTS_COUNT posts each
+INDEX_PAGINATE = False
+
+# Set how many posts each archive, tag and author page lists. The following pages
+# are written to page/N.html under ARCHIVE_PREFIX, the tag or the author. Set them
+# to None to list all the posts in a single page
+ARCHIVE_PAGE_SIZE = None
+TAG_PAGE_SIZE = None
+AUTHOR_PAGE_SIZE = None
+
+# Set how many of the newest posts the atom feed holds, None for all of them
+FEED_MAX_ENTRIES = None
+
 # By default, posts are sort from older to newer, set to True to invert this behaviour (newer first)
 POSTS_SORT_REVERSE = True
 
@@ -63,6 +153,8 @@ TEMPLATES = {
     'authorlist': 'authors.jinja', # the template will receive a list of authors
     'tag': 'tag.jinja', # the template for one tag
     'author': 'author.jinja', # the template for one author
+    'year': 'year.jinja', # the template for the posts of one year
+    'month': 'month.jinja', # the template for the posts of one month
     'feed': 'atom.jinja', # the template for the atom feed
 }
 
@@ -82,6 +174,28 @@ GENERATE_TAGS = True
 # Wether to generate an 'atom.xml' feed or not (True or False)
 GENERATE_FEED = True
 
+# Wether to generate archive pages for every year and month, at YYYY/index.html
+# and YYYY/MM/index.html (True or False). They are paginated as the archive, and
+# skipped with layouts lacking the year and month templates
+GENERATE_DATE_ARCHIVES = True
+
+# Wether to write a search index of the posts under SEARCH_PATH, along with the
+# search.js client querying it from the browser (True or False). The index is
+# split in shards by the first SEARCH_PREFIX_LENGTH characters of the terms, and
+# the words in SEARCH_STOPWORDS (None for the common English ones) are left out
+GENERATE_SEARCH_INDEX = False
+SEARCH_PATH = 'search'
+SEARCH_PREFIX_LENGTH = 2
+SEARCH_STOPWORDS = None
+
+# Set how many related posts every post gets, as post.related in the post template.
+# Posts are related by the tags and title words they share. Finding them takes
+# time growing with the square of the posts, minutes for 20000 posts in pure
+# Python, so install NumPy and SciPy for big blogs. Any change to the posts makes
+# the related posts of all of them be found again, though only the posts whose
+# related posts changed are rendered again. 0 to disable
+RELATED_POSTS = 0
+
 # This is a dict with the default options for posts, which can be overriden
 # by setting the keys on the YAML header in the post .md file
 POST_DEFAULTS = {
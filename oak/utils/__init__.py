@@ -2,12 +2,121 @@
 "Helper functions for oak"
 
 import datetime
+import filecmp
 import hashlib
 import os
+import re
 import shutil
-import time
+import tempfile
+
+# The process umask, applied to the files created through temporary files
+_umask = os.umask(0)
+os.umask(_umask)
+
+def makedirs_(path):
+    """Creates the directory `path` and its parents unless it exists,
+    tolerating it being created meanwhile by another process.
+    """
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+
+def _replace(dst, fill, umask_mode=True):
+    """Atomically replaces `dst` with a new file.
+
+    The new file is written by `fill`, which gets a temporary file in the
+    same directory (opened for writing, and its path), and then renamed
+    over `dst`, so readers never see a partially written file. `fill` may
+    return False to leave `dst` untouched.
+
+    :param umask_mode: whether to give the new file the mode new files get
+        from the umask, instead of the one `fill` left
+
+    :returns: True if `dst` was replaced
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst) or '.', prefix='.oak')
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            replace = fill(f, tmp) is not False
+        finally:
+            f.close()
+        if not replace:
+            os.remove(tmp)
+            return False
+        if umask_mode:
+            os.chmod(tmp, 0666 & ~_umask)
+        os.rename(tmp, dst)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return True
+
+def write_if_changed(filename, data, makedirs=True):
+    """Writes `data` in `filename` unless it already holds exactly that.
+
+    :param filename: the output file name
+    :param data: the bytes to write
+    :type data: string
+    :param makedirs: whether to create the directory of the file if needed
+
+    :returns: True if the file was written, False if it was left untouched
+    """
+    try:
+        if os.path.getsize(filename) == len(data):
+            f = open(filename, 'rb')
+            try:
+                if f.read() == data:
+                    return False
+            finally:
+                f.close()
+    except (IOError, OSError):
+        pass
+    if makedirs and os.path.dirname(filename):
+        makedirs_(os.path.dirname(filename))
+    return _replace(filename, lambda f, tmp: f.write(data))
+
+def write_chunks_if_changed(filename, chunks):
+    """Writes the bytes produced by `chunks` in `filename` unless it
+    already holds exactly that. Unlike write_if_changed, the whole content
+    is never held in memory.
+
+    :param filename: the output file name
+    :param chunks: an iterator over strings
+
+    :returns: True if the file was written, False if it was left untouched
+    """
+    def fill(f, tmp):
+        for chunk in chunks:
+            f.write(chunk)
+        f.flush()
+        return not (os.path.isfile(filename) and filecmp.cmp(tmp, filename, shallow=False))
+    if os.path.dirname(filename):
+        makedirs_(os.path.dirname(filename))
+    return _replace(filename, fill)
+
+def copy_if_changed(src, dst):
+    """Copies `src` to `dst` with its stats unless `dst` already has the
+    same contents.
+
+    :returns: True if the file was copied, False if it was left untouched
+    """
+    if os.path.isfile(dst) and filecmp.cmp(src, dst, shallow=True):
+        return False
+    # copy2 gives the copy the mode of src
+    return _replace(dst, lambda f, tmp: shutil.copy2(src, tmp), umask_mode=False)
 
 def copytree_(src, dst):
+    """Copies the tree at `src` into `dst`, skipping the files which are
+    already up to date.
+
+    :returns: a tuple with the count of copied and skipped files
+    """
+    copied = skipped = 0
     names = os.listdir(src)
     if not os.path.exists(dst):
         os.mkdir(dst)
@@ -16,27 +125,123 @@ def copytree_(src, dst):
         dstname = os.path.join(dst, name)
         try:
             if os.path.isdir(srcname):
-                copytree_(srcname, dstname)
+                c, s = copytree_(srcname, dstname)
+                copied += c
+                skipped += s
+            elif copy_if_changed(srcname, dstname):
+                copied += 1
             else:
-                shutil.copy2(srcname, dstname)
+                skipped += 1
         except (IOError, os.error), why:
             raise Exception(why)
     try:
         shutil.copystat(src, dst)
     except OSError, why:
         raise Exception(why)
+    return copied, skipped
+
+def fill_settings(settings):
+    """Sets the oak defaults for the options missing in `settings`
+
+    Projects keep the settings.py they were created with, so options added
+    in newer versions of oak are taken from the bundled settings module,
+    as are the entries added to TEMPLATES and HTMLS.
+
+    :param settings: the settings module of the project
+    :returns: the settings module
+    """
+    from oak import settings as defaults
+    for k in dir(defaults):
+        if k.isupper() and not hasattr(settings, k):
+            setattr(settings, k, getattr(defaults, k))
+    # so are the templates and pages added to these
+    for k in ('TEMPLATES', 'HTMLS'):
+        for name, value in getattr(defaults, k).items():
+            getattr(settings, k).setdefault(name, value)
+    return settings
+
+_TAGS_RE = re.compile(r'<[^>]*>')
+_SPACES_RE = re.compile(r'\s+')
+
+def plain_text(html):
+    """Returns the text of `html`, without tags and with its whitespace
+    collapsed
+
+    :returns: string
+    """
+    if not html:
+        return u''
+    return _SPACES_RE.sub(u' ', _TAGS_RE.sub(u' ', html)).strip()
+
+def excerpt(html, length=200):
+    """Returns the beginning of `html` as plain text, cut at a word
+    boundary to at most `length` characters.
+
+    :param html: the HTML (or text) to take the excerpt from
+    :param length: the maximum length of the excerpt
+
+    :returns: string
+    """
+    text = plain_text(html)
+    if len(text) <= length:
+        return text
+    cut = text[:length].rsplit(u' ', 1)[0]
+    return u"%s\u2026" % (cut,)
+
+def parse_date(value, iformat="%Y-%m-%d %H:%M:%S"):
+    """Returns `value` as a datetime. Dates are taken at midnight and
+    anything else is parsed as a string in `iformat`.
+
+    :raises: ValueError
+    :returns: datetime.datetime
+    """
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day)
+    return datetime.datetime.strptime(str(value), iformat)
+
+# The dates already formatted by the filters, by filter, value and arguments
+_formatted_dates = {}
+
+# The formatted dates kept at most, they're all dropped beyond that
+MAX_FORMATTED_DATES = 10000
+
+def _memoized(f):
+    """Remembers what the date filter `f` returns, as the same dates are
+    rendered again on every listing page and in the feed.
+    """
+    def memoized(value, *args, **kwargs):
+        key = (f.__name__, value, args, tuple(sorted(kwargs.items())))
+        try:
+            return _formatted_dates[key]
+        except KeyError:
+            if len(_formatted_dates) >= MAX_FORMATTED_DATES:
+                # a long running process mustn't keep every date it formatted
+                _formatted_dates.clear()
+            result = _formatted_dates[key] = f(value, *args, **kwargs)
+            return result
+        except TypeError:
+            # unhashable value
+            return f(value, *args, **kwargs)
+    memoized.__name__ = f.__name__
+    memoized.__doc__ = f.__doc__
+    return memoized
 
 class Filters:
     @staticmethod
+    @_memoized
     def datetimeformat(value, oformat='%Y-%m-%d', iformat="%Y-%m-%d %H:%M:%S"):
-        return time.strftime(oformat, time.strptime(str(value), iformat))
+        return parse_date(value, iformat).strftime(oformat)
 
     @staticmethod
+    @_memoized
     def my_date(value=None, oformat='a', iformat='%Y-%m-%d %H:%M:%S'):
         """
             oformat values:
             'a': Dow, month dom, year
             'b': month dom, year
+            'c': ISO 8601
         """
         days = {
             0: ['Mon', 'Monday'],
@@ -61,13 +266,13 @@ class Filters:
             11: ['Nov', 'November'],
             12: ['Dec', 'December'],
         }
-        d = time.strptime(str(value), iformat)
+        d = parse_date(value, iformat)
         if oformat == 'a':
-            return "%s, %s %s, %s" % (days[d.tm_wday][1], months[d.tm_mon][1], d.tm_mday, d.tm_year)
+            return "%s, %s %s, %s" % (days[d.weekday()][1], months[d.month][1], d.day, d.year)
         if oformat == 'b':
-            return "%s %s, %s" % (months[d.tm_mon][0], d.tm_mday, d.tm_year)
+            return "%s %s, %s" % (months[d.month][0], d.day, d.year)
         if oformat == 'c':
-            return datetime.datetime.fromtimestamp(time.mktime(d)).isoformat()
+            return d.isoformat()
 
     @staticmethod
     def longdate(value):
@@ -94,8 +299,7 @@ class Atom(object):
         """
         import urlparse
         u = urlparse.urlsplit(post['url'])
-        d = post['metadata']['pub_date']
-        d = Filters.datetimeformat(d)
+        d = parse_date(post['metadata']['pub_date']).strftime('%Y-%m-%d')
         _id = "tag:%s,%s:%s" % (u.hostname, d, u.path)
         return _id
 
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"A size-bounded, content-addressed cache stored on disk"
+
+import hashlib
+import os
+import tempfile
+
+
+def cache_key(*parts):
+    """Calculates a cache key from the given parts
+
+    Unicode parts are hashed UTF-8 encoded, anything else by its repr.
+
+    :returns: string
+    """
+    h = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, unicode):
+            part = part.encode('utf-8')
+        elif not isinstance(part, str):
+            part = repr(part)
+        h.update(part)
+        h.update('\0')
+    return h.hexdigest()
+
+
+class DiskCache(object):
+    """Stores strings on disk under a directory, one file per key.
+
+    Entries are looked up by key (see cache_key) and are never stale: the
+    key has to change when the value would. When max_size is set, prune
+    evicts the least recently used entries until the cache fits in it.
+
+    """
+
+    def __init__(self, path, max_size=None):
+        """Initializes the cache
+
+        :param path: the directory holding the entries
+        :param max_size: the maximum size in bytes of the cache, or None
+        """
+        self.path = path
+        self.max_size = max_size
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, key):
+        """Returns the value stored for `key`, or None
+
+        :returns: string
+        """
+        path = self._entry_path(key)
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return None
+        try:
+            value = f.read()
+        finally:
+            f.close()
+        try:
+            # mark the entry as recently used
+            os.utime(path, None)
+        except OSError:
+            pass
+        return value
+
+    def set(self, key, value):
+        """Stores `value` under `key`.
+
+        The entry is written to a temporary file and renamed, so readers
+        (other workers included) never see partial entries.
+
+        :param value: the value to store
+        :type value: string
+        """
+        path = self._entry_path(key)
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                if not os.path.isdir(dirname):
+                    raise
+        fd, tmp = tempfile.mkstemp(dir=dirname)
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                f.write(value)
+            finally:
+                f.close()
+            os.rename(tmp, path)
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def prune(self):
+        """Evicts the least recently used entries until the cache fits in
+        max_size.
+
+        :returns: the number of entries evicted
+        """
+        if not self.max_size or not os.path.isdir(self.path):
+            return 0
+        entries = []
+        total = 0
+        for root, dirs, files in os.walk(self.path):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        evicted = 0
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+        return evicted
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""Parsing of the YAML headers of the posts.
+
+Headers are loaded with the safe loader of PyYAML, the libyaml based one
+when available. Most headers are just a few `key: value` lines with
+quoted strings, dates and lists of quoted strings, which parse_simple
+handles without going through YAML at all, giving the same result.
+
+"""
+
+import datetime
+import re
+
+import yaml
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+_LINE_RE = re.compile(r'^( *)([A-Za-z_][A-Za-z0-9_]*):(?: +(.*?))? *$')
+_SINGLE_RE = re.compile(r"^'((?:[^']|'')*)'$")
+_DOUBLE_RE = re.compile(r'^"([^"\\]*)"$')
+_PLAIN_RE = re.compile(r'^[A-Za-z][A-Za-z0-9_ .-]*$')
+_INT_RE = re.compile(r'^(?:0|[1-9][0-9]*)$')
+_DATETIME_RE = re.compile(r'^(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d):(\d\d)$')
+_DATE_RE = re.compile(r'^(\d{4})-(\d\d)-(\d\d)$')
+_ITEM = r"""'(?:[^']|'')*'|"[^"\\]*"|[A-Za-z][A-Za-z0-9_ .-]*"""
+_LIST_RE = re.compile(r'^\[ *(?:(?:%s) *(?:, *(?:%s) *)*)?\]$' % (_ITEM, _ITEM))
+_ITEMS_RE = re.compile(_ITEM)
+
+# Plain scalars YAML resolves to something else than a string
+_SPECIAL = frozenset(['yes', 'no', 'true', 'false', 'on', 'off', 'null'])
+
+class _NotSimple(Exception):
+    pass
+
+
+def _str(value):
+    # as PyYAML does on Python 2, ASCII strings are returned as str
+    try:
+        return str(value)
+    except UnicodeEncodeError:
+        return value
+
+
+def _scalar(token):
+    """Returns the value of a single scalar token
+
+    :raises: _NotSimple
+    """
+    m = _SINGLE_RE.match(token)
+    if m:
+        return _str(m.group(1).replace(u"''", u"'"))
+    m = _DOUBLE_RE.match(token)
+    if m:
+        return _str(m.group(1))
+    try:
+        m = _DATETIME_RE.match(token)
+        if m:
+            return datetime.datetime(*[int(g) for g in m.groups()])
+        m = _DATE_RE.match(token)
+        if m:
+            return datetime.date(*[int(g) for g in m.groups()])
+    except ValueError:
+        # no such date, YAML reports it
+        raise _NotSimple(token)
+    if _INT_RE.match(token):
+        return int(token)
+    token = token.rstrip()
+    if _PLAIN_RE.match(token) and token.lower() not in _SPECIAL:
+        return _str(token)
+    raise _NotSimple(token)
+
+
+def parse_simple(text):
+    """Parses a header made only of `key: value` lines, at the same
+    indentation, whose values are quoted strings, single words or
+    phrases, integers, dates, date and times or flow lists of those.
+
+    :returns: dict, or None if the header is not that simple
+    """
+    result = {}
+    indent = None
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        m = _LINE_RE.match(line)
+        if not m:
+            return None
+        if indent is None:
+            indent = m.group(1)
+        elif m.group(1) != indent:
+            return None
+        token = m.group(3)
+        if not token or m.group(2).lower() in _SPECIAL:
+            return None
+        try:
+            if token.startswith('['):
+                if not _LIST_RE.match(token):
+                    return None
+                value = [_scalar(t) for t in _ITEMS_RE.findall(token)]
+            else:
+                value = _scalar(token)
+        except _NotSimple:
+            return None
+        result[_str(m.group(2))] = value
+    if not result:
+        return None
+    return result
+
+
+def parse_header(text, fast=True):
+    """Parses the YAML header of a post
+
+    :param text: the header, without the marks
+    :param fast: whether to try parse_simple before YAML
+
+    :returns: the parsed header, usually a dict
+    :raises: yaml.YAMLError
+    """
+    if fast:
+        result = parse_simple(text)
+        if result is not None:
+            return result
+    return yaml.load(text, Loader=SafeLoader)
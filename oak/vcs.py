@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""Changes recorded by the version control system
+
+Blogs kept in a git repository can be generated again taking just the
+files changed since a revision as modified, instead of checking every
+source, as the hooks in bin/hooks do after a push. Incremental builds
+can record the revision they generated (see clean_revision) so the next one
+can list the changes since it, whatever happened in between.
+
+"""
+
+import os
+import subprocess
+
+
+class VCSError(Exception):
+    """Raised when the changes can't be listed"""
+    def __init__(self, msg):
+        Exception.__init__(self, msg)
+        self.msg = msg
+
+
+def _git(args, cwd=None):
+    """Runs git with `args`
+
+    :returns: its output
+    :raises: VCSError
+    """
+    try:
+        p = subprocess.Popen(['git'] + args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate()
+    except OSError, e:
+        raise VCSError("Unable to run git: %s" % (e,))
+    if p.returncode:
+        raise VCSError(err.strip() or "git %s failed" % (args[0],))
+    return out
+
+
+def changed_since(rev, cwd=None):
+    """Lists the files changed since the git revision `rev`, committed or
+    not, or between the revisions of a range like `rev1..rev2`. Removed
+    and renamed files are listed too.
+
+    Only the files under `cwd` are listed, relative to it.
+
+    :param rev: the revision or revision range
+    :param cwd: the directory of the project, the current one if None
+
+    :returns: list
+    :raises: VCSError
+    """
+    out = _git(['diff', '--name-only', '--no-renames', '--relative', '-z', rev, '--'], cwd)
+    return [os.path.normpath(f) for f in out.split('\0') if f]
+
+
+def clean_revision(path='.', cwd=None):
+    """Returns the git revision checked out, if the files under `path`
+    are all as committed in it: none modified, none untracked.
+
+    :param path: the directory to check, relative to `cwd`
+    :param cwd: the directory of the project, the current one if None
+
+    :returns: the commit id, or None when a file under `path` differs
+    :raises: VCSError
+    """
+    if _git(['status', '--porcelain', '-z', '--', path], cwd):
+        return None
+    return _git(['rev-parse', '--verify', 'HEAD'], cwd).strip()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""Oak watcher
+
+Polls the project directories for changes, so the site can be generated
+again as soon as a file is saved.
+
+"""
+
+import os
+import time
+
+
+class Watcher(object):
+    """Watches a set of directories by polling the mtime and size of the
+    files in them.
+
+    """
+
+    def __init__(self, paths, interval=0.5):
+        """Initializes the watcher and takes the first snapshot
+
+        :param paths: the directories to watch, missing ones are ignored
+        :type paths: list
+        :param interval: the seconds between checks
+        """
+        self.paths = paths
+        self.interval = interval
+        self.state = self.snapshot()
+
+    def snapshot(self):
+        """Returns the current mtime and size of every watched file
+
+        :returns: dict
+        """
+        state = {}
+        for path in self.paths:
+            for root, dirs, files in os.walk(path):
+                for name in files:
+                    f = os.path.join(root, name)
+                    try:
+                        st = os.stat(f)
+                    except OSError:
+                        continue
+                    state[f] = (st.st_mtime, st.st_size)
+        return state
+
+    def changes(self):
+        """Checks the watched files once.
+
+        :returns: the list of files added, modified or removed since the last check
+        """
+        state = self.snapshot()
+        changed = [f for f in state if self.state.get(f) != state[f]]
+        changed.extend(f for f in self.state if f not in state)
+        self.state = state
+        return changed
+
+    def watch(self, callback):
+        """Calls `callback` with the list of changed files every time some
+        change, until interrupted.
+
+        :param callback: a callable getting the list of changed files
+        """
+        while True:
+            time.sleep(self.interval)
+            changed = self.changes()
+            if changed:
+                callback(changed)
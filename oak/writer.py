@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Background output writer
+
+Rendering a page and writing it to disk can overlap: pages are queued to
+a writer thread, which checks whether each file changed, creates the
+directories it didn't create already and replaces the files, taking as
+many pages from the queue as are waiting, up to the batch size, on each
+round. The queue is bounded, so pages don't pile up in memory when the
+disk is slower than the rendering.
+
+The first failed write is kept and raised by the next call to write or
+by close, the files queued after it are not written.
+
+"""
+
+import errno
+import os
+import Queue
+import threading
+
+from oak.utils import makedirs_, write_if_changed
+
+# Queued by close and abort to stop the writer thread
+_STOP = object()
+
+
+class WriteError(Exception):
+    """Raised when a queued file couldn't be written"""
+    def __init__(self, filename, msg):
+        Exception.__init__(self, "Unable to write %s: %s" % (filename, msg))
+        self.filename = filename
+        self.msg = msg
+
+
+class Writer(object):
+    """Writes files from a background thread"""
+
+    def __init__(self, queue_size=64, batch_size=16, fsync=False, callback=None):
+        """Initializes the writer and starts its thread
+
+        :param queue_size: the number of files waiting to be written at most
+        :param batch_size: the number of files taken from the queue at once
+        :param fsync: whether to flush the written files to disk on close
+        :param callback: called from the writer thread with the file name,
+            its size and whether it was written or left untouched
+        """
+        self.queue = Queue.Queue(queue_size)
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.callback = callback
+        self.dirs = set()
+        self.written = []
+        self.error = None
+        self.aborted = False
+        self.thread = threading.Thread(target=self._run, name='oak-writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _check(self):
+        if self.error is not None:
+            raise self.error
+
+    def write(self, filename, data):
+        """Queues `data` to be written in `filename` unless it already
+        holds exactly that, waiting if the queue is full.
+
+        :param data: the bytes to write
+        :raises: WriteError if a previous write failed
+        """
+        self._check()
+        if not self.aborted:
+            self.queue.put((filename, data))
+
+    def close(self):
+        """Waits until every queued file is written
+
+        :raises: WriteError if a write failed
+        """
+        self.queue.put(_STOP)
+        self.thread.join()
+        self._check()
+
+    def abort(self):
+        """Stops the writer thread, dropping the files still queued
+        """
+        self.aborted = True
+        self.queue.put(_STOP)
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size and batch[-1] is not _STOP:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+            for item in batch:
+                if item is _STOP:
+                    self._sync()
+                    return
+                if self.error is None and not self.aborted:
+                    try:
+                        self._write(*item)
+                    except Exception, e:
+                        # keep taking files, so nobody waits on a full queue
+                        self.error = WriteError(item[0], e)
+
+    def _write(self, filename, data):
+        dirname = os.path.dirname(filename)
+        if dirname and dirname not in self.dirs:
+            makedirs_(dirname)
+            self.dirs.add(dirname)
+        try:
+            written = write_if_changed(filename, data, makedirs=False)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            # removed meanwhile along with a stale page
+            makedirs_(dirname)
+            written = write_if_changed(filename, data, makedirs=False)
+        if written and self.fsync:
+            self.written.append(filename)
+        if self.callback:
+            self.callback(filename, len(data), written)
+
+    def _sync(self):
+        if not self.fsync or self.error is not None or self.aborted:
+            return
+        # the files first, then the directories holding their new names
+        dirs = sorted(set(os.path.dirname(f) or '.' for f in self.written))
+        for path in self.written + dirs:
+            try:
+                _fsync(path)
+            except (IOError, OSError), e:
+                self.error = WriteError(path, e)
+                break
+        self.written = []
+
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
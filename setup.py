@@ -18,8 +18,8 @@ setup(
     author='marc0s',
     author_email='marc0s@fsfe.org',
     packages=['oak', 'oak.models', 'oak.processors', 'oak.utils'],
-    package_data={'oak': ['scripts/manage.py', ] + find_templates() },
-    scripts=['bin/oak-admin.py',],
+    package_data={'oak': ['scripts/manage.py', 'search.js', ] + find_templates() },
+    scripts=['bin/oak-admin.py', 'bin/oak-bench.py',],
     requires=['Jinja2','Markdown','PyYAML','Pygments'],
     license='WTFPL',
     description='A simple static-blog generator',
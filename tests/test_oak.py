@@ -0,0 +1,896 @@
+# -*- coding: utf-8 -*-
+"""Tests of oak
+
+Run them from the top of the source tree with:
+
+$ python -m unittest discover tests
+
+"""
+
+import datetime
+import filecmp
+import gzip
+import imp
+import json
+import logging
+import os
+import random
+import shutil
+import StringIO
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+# the oak being tested, by absolute path as the tests change directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yaml
+
+import oak
+from oak import utils
+from oak.assets import Assets, minify_css, hashed_name
+from oak.benchmark import generate_corpus
+from oak.compress import precompress
+from oak.index import PostIndex
+from oak.metrics import JSONLinesWriter, Metrics
+from oak.models.post import Post, PostError, PostSummary
+from oak.processors.processor import MarkdownProcessor, get_processor, use_caches
+from oak.profiler import POST_PARTS, Profiler
+from oak.related import related
+from oak import search
+from oak.search import DOCS_NAME, SearchIndex, post_terms, shard_name, tokenize
+from oak.utils import Filters, fill_settings, write_if_changed
+from oak.utils.frontmatter import parse_simple
+from oak.vcs import clean_revision
+from oak.writer import Writer, WriteError
+
+# the module, the package has a function of the same name
+related_module = sys.modules['oak.related']
+
+logger = logging.getLogger('oak.tests')
+logger.addHandler(logging.NullHandler())
+logger.propagate = False
+
+
+def load_settings(path, **overrides):
+    """Loads the settings of the project at `path`, with the bundled
+    layouts, and sets `overrides` on them
+    """
+    settings = fill_settings(imp.load_source("oak_test_settings_%d" % (id(path),),
+                                             os.path.sep.join([path, 'settings.py'])))
+    settings.LAYOUTS_PATH = os.path.sep.join([os.path.dirname(oak.__file__), 'layouts'])
+    for name, value in overrides.iteritems():
+        setattr(settings, name, value)
+    return settings
+
+
+def generate(path, **overrides):
+    """Generates the project at `path`
+
+    :returns: the Oak instance
+    """
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        my_oak = oak.Oak(logger=logger, settings=load_settings(path, **overrides))
+        my_oak.generate()
+        return my_oak
+    finally:
+        os.chdir(cwd)
+
+
+def same_tree(a, b):
+    """Lists the differences between the directories `a` and `b`
+
+    :returns: list of paths relative to them, empty if they're the same
+    """
+    differences = []
+    cmp = filecmp.dircmp(a, b)
+    differences.extend(cmp.left_only + cmp.right_only + cmp.funny_files)
+    # shallow=False, the files may have been written in the same second
+    differences.extend(filecmp.cmpfiles(a, b, cmp.common_files, shallow=False)[1])
+    for d in cmp.common_dirs:
+        differences.extend(os.path.join(d, f) for f in same_tree(os.path.join(a, d), os.path.join(b, d)))
+    return differences
+
+
+def fake_post(n, pub_date, tags=(), author='someone'):
+    return {
+        'id': "post-%d" % (n,),
+        'metadata': {'pub_date': pub_date, 'tags': list(tags), 'author': author},
+    }
+
+
+class TempDirTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='oaktest')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+
+class IncrementalTest(TempDirTestCase):
+    """Incremental builds must give the site a clean build gives"""
+
+    def corpus(self, name):
+        path = os.path.sep.join([self.tmp, name])
+        generate_corpus(path, posts=24, tags=6, authors=3, code_blocks=1, paragraphs=2, statics=2)
+        return path
+
+    def edit(self, path):
+        content = os.path.sep.join([path, 'content'])
+        names = sorted(os.listdir(content))
+        # a new title and body, a new tag, a post gone and a post added
+        f = open(os.path.sep.join([content, names[3]]))
+        text = f.read()
+        f.close()
+        f = open(os.path.sep.join([content, names[3]]), 'w')
+        f.write(text.replace("tags: [", "tags: ['edited', ", 1).replace("title: '", "title: 'Edited ", 1) + "\nOne more line.\n")
+        f.close()
+        os.remove(os.path.sep.join([content, names[10]]))
+        f = open(os.path.sep.join([content, '2010-01-new-post.md']), 'w')
+        f.write("---\n  title: 'A new post'\n  author: 'author 9'\n  pub_date: 2010-01-02 10:00:00\n"
+                "  tags: ['tag1', 'new']\n---\n\nNew.\n\nThe body of the new post.\n")
+        f.close()
+
+    def check(self, **overrides):
+        incremental = self.corpus('incremental')
+        generate(incremental, INCREMENTAL=True, **overrides)
+        self.edit(incremental)
+        generate(incremental, INCREMENTAL=True, **overrides)
+        clean = self.corpus('clean')
+        self.edit(clean)
+        generate(clean, **overrides)
+        self.assertEqual(same_tree(os.path.sep.join([incremental, 'site']), os.path.sep.join([clean, 'site'])), [])
+
+    def test_incremental(self):
+        self.check()
+
+    def test_incremental_paginated(self):
+        self.check(ARCHIVE_PAGE_SIZE=5, TAG_PAGE_SIZE=3, AUTHOR_PAGE_SIZE=4, INDEX_PAGINATE=True, POSTS_COUNT=7)
+
+    def test_incremental_related(self):
+        self.check(RELATED_POSTS=3)
+
+    def test_same_instance(self):
+        path = self.corpus('incremental')
+        cwd = os.getcwd()
+        os.chdir(path)
+        try:
+            my_oak = oak.Oak(logger=logger, settings=load_settings(path, INCREMENTAL=True))
+            my_oak.generate()
+            self.edit(path)
+            my_oak.generate()
+        finally:
+            os.chdir(cwd)
+        clean = self.corpus('clean')
+        self.edit(clean)
+        generate(clean)
+        self.assertEqual(same_tree(os.path.sep.join([path, 'site']), os.path.sep.join([clean, 'site'])), [])
+
+
+class LowMemoryTest(TempDirTestCase):
+    """Low memory mode must give the site a normal build gives"""
+
+    def check(self, **overrides):
+        clean = os.path.sep.join([self.tmp, 'clean'])
+        low = os.path.sep.join([self.tmp, 'low'])
+        for path in (clean, low):
+            generate_corpus(path, posts=24, tags=6, authors=3, code_blocks=1, paragraphs=2, statics=0)
+        generate(clean, **overrides)
+        my_oak = generate(low, LOW_MEMORY=True, **overrides)
+        self.assertTrue(all(isinstance(post, PostSummary) and 'raw' not in post for post in my_oak.posts))
+        self.assertEqual(same_tree(os.path.sep.join([low, 'site']), os.path.sep.join([clean, 'site'])), [])
+
+    def test_low_memory(self):
+        self.check()
+
+    def test_low_memory_paginated(self):
+        self.check(ARCHIVE_PAGE_SIZE=5, TAG_PAGE_SIZE=3, INDEX_PAGINATE=True, POSTS_COUNT=7, FEED_MAX_ENTRIES=10)
+
+
+class SinceGeneratedTest(TempDirTestCase):
+    """Generating what changed since the revision generated last makes up
+    for the generations which failed"""
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.path = os.path.sep.join([self.tmp, 'blog'])
+        generate_corpus(self.path, posts=6, code_blocks=0, paragraphs=1, statics=0)
+        f = open(os.path.sep.join([self.path, '.gitignore']), 'w')
+        f.write("site/\n.oak/\n")
+        f.close()
+        self.git('init', '-q')
+        self.git('add', '.')
+        self.git('commit', '-q', '-m', 'The posts')
+
+    def git(self, *args):
+        devnull = open(os.devnull, 'w')
+        try:
+            subprocess.check_call(['git', '-c', 'user.name=oak', '-c', 'user.email=oak@example.com'] + list(args),
+                                  cwd=self.path, stdout=devnull, stderr=devnull)
+        finally:
+            devnull.close()
+
+    def edit(self, n, commit=True):
+        f = open(os.path.sep.join([self.path, 'content', '2005-01-post-%d.md' % (n,)]), 'a')
+        f.write("\nEdited %d.\n" % (n,))
+        f.close()
+        if commit:
+            self.git('commit', '-q', '-a', '-m', 'Edit %d' % (n,))
+
+    def page(self, n):
+        return os.path.sep.join([self.path, 'site', '2005', '01', '2005-01-post-%d.html' % (n,)])
+
+    def generate(self):
+        """Generates the blog as --since-generated does
+
+        :returns: the Oak instance
+        """
+        cwd = os.getcwd()
+        os.chdir(self.path)
+        try:
+            my_oak = oak.Oak(logger=logger, settings=load_settings(self.path, INCREMENTAL=True))
+            my_oak.generate(revision=clean_revision('content'))
+            return my_oak
+        finally:
+            os.chdir(cwd)
+
+    def test_failed_generation(self):
+        self.assertEqual(self.generate().manifest.revision, clean_revision(cwd=self.path))
+        self.edit(1)
+        os.remove(self.page(1))
+        os.mkdir(self.page(1))
+        self.assertRaises(WriteError, self.generate)
+        os.rmdir(self.page(1))
+        self.edit(2)
+        my_oak = self.generate()
+        # the changes of the failed generation too
+        self.assertEqual(my_oak.changed_sources, set(os.path.sep.join([self.path, 'content', '2005-01-post-%d.md' % (n,)])
+                                                     for n in (1, 2)))
+        for n in (1, 2):
+            f = open(self.page(n))
+            self.assertTrue("Edited %d." % (n,) in f.read())
+            f.close()
+        self.assertEqual(my_oak.manifest.revision, clean_revision(cwd=self.path))
+
+    def test_uncommitted(self):
+        self.generate()
+        self.edit(3, commit=False)
+        self.assertEqual(clean_revision('content', self.path), None)
+        my_oak = self.generate()
+        self.assertEqual(my_oak.manifest.revision, None)
+        # every file is checked by the next one
+        self.git('commit', '-q', '-a', '-m', 'Edit 3')
+        self.edit(4, commit=False)
+        self.assertEqual(self.generate().changed_sources, None)
+        f = open(self.page(4))
+        self.assertTrue("Edited 4." in f.read())
+        f.close()
+
+
+class ParseSimpleTest(unittest.TestCase):
+    """parse_simple must parse headers as YAML does, or leave them to it"""
+
+    HEADERS = [
+        "title: 'A title'\nauthor: 'Someone'\npub_date: 2012-03-04 05:06:07\ntags: ['a', 'b c']",
+        "  title: 'It''s quoted'\n  pub_date: 2012-03-04\n  tags: []",
+        'title: "Double quoted"\ncount: 42\nzero: 0',
+        "title: Plain words here\ntags: [one, 'two', \"three\"]",
+        u"title: 'Ünïcode'\ntags: ['ñ']",
+        "title: yes\n",
+        "title: 'x'\npublished: no",
+        "title: 'x'\n  author: 'indented'",
+        "title: 'x'\ntags:\n  - a\n  - b",
+        "title: 007",
+        "title: 1.5",
+        "title: 'x' # comment",
+        "title: \"escaped \\\" quote\"",
+        "title: 'x'\nnull: 'y'",
+        "title: 2012-13-45",
+        "title: [a, [b]]",
+        "title: a: b",
+        "",
+    ]
+
+    def test_headers(self):
+        for header in self.HEADERS:
+            try:
+                expected = yaml.safe_load(header)
+            except (yaml.YAMLError, ValueError):
+                # a syntax error, or no such date
+                expected = None
+            result = parse_simple(header)
+            if result is not None:
+                self.assertEqual(result, expected, header)
+                for key, value in result.iteritems():
+                    self.assertEqual(type(value), type(expected[key]), header)
+
+
+class PaginateTest(TempDirTestCase):
+    """Listings are split in pages at the right places"""
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        path = os.path.sep.join([self.tmp, 'blog'])
+        generate_corpus(path, posts=0, statics=0)
+        # the caches go under the project, as when generating
+        cwd = os.getcwd()
+        os.chdir(path)
+        try:
+            self.oak = oak.Oak(logger=logger, settings=load_settings(path))
+        finally:
+            os.chdir(cwd)
+
+    def paginate(self, count, page_size):
+        return self.oak._paginate(range(count), page_size, 'first.html', 'first.html', ['list'])
+
+    def test_boundaries(self):
+        for count, page_size, sizes in [(0, 3, [0]), (1, 3, [1]), (3, 3, [3]), (4, 3, [3, 1]),
+                                        (6, 3, [3, 3]), (7, 3, [3, 3, 1]), (5, None, [5]), (0, None, [0])]:
+            pages = self.paginate(count, page_size)
+            self.assertEqual([len(p[0]) for p in pages], sizes, (count, page_size))
+            self.assertEqual(sum((p[0] for p in pages), []), range(count))
+            self.assertEqual([p[2]['page'] for p in pages], range(1, len(sizes) + 1))
+            for p in pages:
+                self.assertEqual(p[2]['pages'], len(sizes))
+
+    def test_links(self):
+        pages = self.paginate(7, 3)
+        urls = pages[0][2]['urls']
+        self.assertEqual(urls, ["%s/first.html" % (self.oak.blog_url,),
+                                "%s/list/page/2.html" % (self.oak.blog_url,),
+                                "%s/list/page/3.html" % (self.oak.blog_url,)])
+        self.assertEqual([p[1] for p in pages], ['first.html', 'site/list/page/2.html', 'site/list/page/3.html'])
+        self.assertEqual([(p[2]['prev'], p[2]['next']) for p in pages],
+                         [(None, urls[1]), (urls[0], urls[2]), (urls[1], None)])
+
+
+class PostIndexTest(unittest.TestCase):
+    """The index lists the posts in publication order"""
+
+    def posts(self):
+        day = datetime.datetime(2012, 1, 1)
+        return [
+            fake_post(0, day + datetime.timedelta(days=40), ['b', 'a']),
+            fake_post(1, day, ['a'], 'other'),
+            fake_post(2, day + datetime.timedelta(days=400), ['c']),
+            # published at the same time as the first one
+            fake_post(3, day + datetime.timedelta(days=40), ['a']),
+            fake_post(4, day + datetime.timedelta(days=1), [], 'other'),
+        ]
+
+    def build(self, reverse):
+        index = PostIndex(fill_settings(oak.settings), lambda a: "authors/%s.html" % (a,), reverse)
+        for post in self.posts():
+            index.add(post)
+        return index.build()
+
+    def ids(self, posts):
+        return [p['id'] for p in posts]
+
+    def test_order(self):
+        index = self.build(False)
+        self.assertEqual(self.ids(index.posts), ['post-1', 'post-4', 'post-0', 'post-3', 'post-2'])
+        self.assertEqual(index.tags.keys(), ['a', 'b', 'c'])
+        self.assertEqual(self.ids(index.tags['a']['posts']), ['post-1', 'post-0', 'post-3'])
+        self.assertEqual(index.authors.keys(), ['other', 'someone'])
+        self.assertEqual(self.ids(index.authors['other']['posts']), ['post-1', 'post-4'])
+        self.assertEqual(index.years.keys(), [2012, 2013])
+        self.assertEqual(index.months.keys(), [(2012, 1), (2012, 2), (2013, 2)])
+        self.assertEqual(self.ids(index.months[(2012, 2)]), ['post-0', 'post-3'])
+        self.assertEqual(index.newest()['id'], 'post-2')
+        self.assertEqual(sorted(index.by_id), ['post-%d' % (n,) for n in range(5)])
+        self.assertTrue(all(index.by_id[p['id']] is p for p in index.posts))
+
+    def test_reverse(self):
+        index = self.build(True)
+        # posts published at the same time are reversed too
+        self.assertEqual(self.ids(index.posts), ['post-2', 'post-3', 'post-0', 'post-4', 'post-1'])
+        self.assertEqual(self.ids(index.tags['a']['posts']), ['post-3', 'post-0', 'post-1'])
+        self.assertEqual(index.years.keys(), [2013, 2012])
+        self.assertEqual(index.months.keys(), [(2013, 2), (2012, 2), (2012, 1)])
+        self.assertEqual(index.newest()['id'], 'post-2')
+
+
+class WriteIfChangedTest(TempDirTestCase):
+    """Files holding the data already are left untouched"""
+
+    def test_mtime(self):
+        filename = os.path.sep.join([self.tmp, 'dir', 'file.html'])
+        self.assertTrue(write_if_changed(filename, 'contents'))
+        past = int(time.time()) - 3600
+        os.utime(filename, (past, past))
+        self.assertFalse(write_if_changed(filename, 'contents'))
+        self.assertEqual(os.stat(filename).st_mtime, past)
+        self.assertTrue(write_if_changed(filename, 'changed!'))
+        self.assertNotEqual(os.stat(filename).st_mtime, past)
+        f = open(filename, 'rb')
+        self.assertEqual(f.read(), 'changed!')
+        f.close()
+
+
+class FiltersTest(unittest.TestCase):
+    """The date filters remember a bounded number of dates"""
+
+    def test_bounded(self):
+        day = datetime.datetime(2000, 1, 1)
+        for n in range(utils.MAX_FORMATTED_DATES + 10):
+            self.assertEqual(Filters.datetimeformat(day + datetime.timedelta(minutes=n), '%Y-%m-%d %H:%M'),
+                             (day + datetime.timedelta(minutes=n)).strftime('%Y-%m-%d %H:%M'))
+            self.assertTrue(len(utils._formatted_dates) <= utils.MAX_FORMATTED_DATES)
+
+
+class AssetsTest(TempDirTestCase):
+    """Static files get fingerprinted copies"""
+
+    def write(self, name, contents):
+        path = os.path.sep.join([self.tmp, name])
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        f = open(path, 'w')
+        f.write(contents)
+        f.close()
+
+    def test_minify_css(self):
+        self.assertEqual(minify_css("a , b {\n  color : red ; /* it's red */\n}\n"), "a,b{color : red}")
+        self.assertEqual(minify_css("a { content: \"x ;  } /*\" ; background: url( 'a  b.png' ) }"),
+                         "a{content: \"x ;  } /*\";background: url( 'a  b.png' )}")
+        self.assertEqual(minify_css("a{background:url(data:a;b,c  d) no-repeat}"),
+                         "a{background:url(data:a;b,c  d) no-repeat}")
+
+    def test_orphan_copies(self):
+        self.write('css/main.css', 'a { color: red; }')
+        self.write('js/site.12345678.js', 'not a copy')
+        assets = Assets(self.tmp)
+        # a file named like a copy, with no file it could be a copy of
+        self.assertEqual(assets.run(), 2)
+        copy = hashed_name('css/main.css', 'a { color: red; }')
+        self.assertEqual(assets.manifest, {'css/main.css': copy, 'js/site.12345678.js': hashed_name('js/site.12345678.js', 'not a copy')})
+        # the copy of an older main.css, and the manifest is lost
+        self.write('css/main.abcdef12.css', 'a { color: blue; }')
+        os.remove(os.path.sep.join([self.tmp, 'assets.json']))
+        assets = Assets(self.tmp)
+        self.assertEqual(assets.run(), 0)
+        self.assertEqual(sorted(assets.manifest), ['css/main.css', 'js/site.12345678.js'])
+        self.assertEqual(assets.remove_stale(), 1)
+        self.assertFalse(os.path.exists(os.path.sep.join([self.tmp, 'css/main.abcdef12.css'])))
+        self.assertTrue(os.path.exists(os.path.sep.join([self.tmp, copy])))
+
+
+class ProfilerTest(TempDirTestCase):
+    """Posts are timed part by part, each part exclusively"""
+
+    def test_spans(self):
+        now = [0.0]
+        class Clock(object):
+            def time(self):
+                return now[0]
+        my_profiler = Profiler()
+        real_time, oak.profiler.time = oak.profiler.time, Clock()
+        try:
+            with my_profiler.span('read'):
+                now[0] += 1
+            with my_profiler.post('a.md'):
+                with my_profiler.span('markdown'):
+                    now[0] += 1
+                    with my_profiler.span('pygments'):
+                        now[0] += 2
+                    now[0] += 1
+                with my_profiler.span('markdown'):
+                    now[0] += 3
+        finally:
+            oak.profiler.time = real_time
+        my_profiler.add_post_timings('a.md', {'render': 1.0})
+        my_profiler.add_post_timings('b.md', {'render': 0.5})
+        self.assertEqual(my_profiler.post_timings('a.md'), {'markdown': 5.0, 'pygments': 2.0, 'render': 1.0})
+        self.assertEqual(my_profiler.slowest(1), [('a.md', 8.0, my_profiler.post_timings('a.md'))])
+        self.assertEqual(my_profiler.totals()['render'], 1.5)
+        self.assertTrue("2 posts processed" in my_profiler.report())
+
+    def check(self, jobs):
+        path = os.path.sep.join([self.tmp, 'blog'])
+        generate_corpus(path, posts=6, code_blocks=1, paragraphs=1, statics=0)
+        cwd = os.getcwd()
+        os.chdir(path)
+        try:
+            my_oak = oak.Oak(logger=logger, settings=load_settings(path, JOBS=jobs))
+            my_oak.profiler = Profiler()
+            my_oak.generate()
+        finally:
+            os.chdir(cwd)
+        phases = [phase['name'] for phase in my_oak.profiler.phases]
+        self.assertTrue('_do_posts' in phases and '_do_index' in phases)
+        self.assertEqual(sorted(my_oak.profiler.posts), sorted(my_oak.sources))
+        for timings in my_oak.profiler.posts.values():
+            self.assertEqual(sorted(timings), sorted(POST_PARTS))
+
+    def test_generate(self):
+        self.check(1)
+
+    def test_generate_jobs(self):
+        # the workers' timings are sent back with their posts
+        self.check(2)
+
+
+class MetricsTest(TempDirTestCase):
+    """Every change of the metrics is sent to the subscribers"""
+
+    def test_events(self):
+        events = []
+        metrics = Metrics(['written'])
+        metrics.incr('written')
+        metrics.subscribe(events.append)
+        out = StringIO.StringIO()
+        metrics.subscribe(JSONLinesWriter(out))
+        metrics.incr('written', 2, path='a.html')
+        metrics.timing('render', 0.5, kind='post')
+        with metrics.timer('phase', phase='_do_index'):
+            pass
+        metrics.event('generate')
+        self.assertEqual(metrics.counters, {'written': 3})
+        self.assertEqual(metrics.timers['render'], (1, 0.5))
+        self.assertEqual([(e['type'], e['name']) for e in events],
+                         [('counter', 'written'), ('timer', 'render'), ('timer', 'phase'), ('event', 'generate')])
+        self.assertEqual((events[0]['value'], events[0]['total'], events[0]['path']), (2, 3, 'a.html'))
+        self.assertEqual([json.loads(line) for line in out.getvalue().splitlines()], events)
+
+    def check(self, jobs):
+        path = os.path.sep.join([self.tmp, 'blog'])
+        generate_corpus(path, posts=8, code_blocks=0, paragraphs=1, statics=0)
+        events = []
+        cwd = os.getcwd()
+        os.chdir(path)
+        try:
+            my_oak = oak.Oak(logger=logger, settings=load_settings(path, JOBS=jobs))
+            my_oak.metrics.subscribe(events.append)
+            my_oak.generate()
+        finally:
+            os.chdir(cwd)
+        self.assertEqual((events[0]['type'], events[0]['name']), ('event', 'generate'))
+        self.assertEqual((events[-1]['type'], events[-1]['name']), ('timer', 'generate'))
+        # the counts of the post workers are sent too
+        for name, total in my_oak.metrics.counters.items():
+            self.assertEqual(sum(e['value'] for e in events if e['type'] == 'counter' and e['name'] == name), total)
+        pages = 0
+        for root, dirs, files in os.walk(os.path.sep.join([path, 'site'])):
+            if 'static' in dirs:
+                dirs.remove('static')
+            pages += len(files)
+        self.assertEqual(my_oak.metrics.counters['written'], pages)
+        self.assertEqual(my_oak.metrics.counters['pages'], pages)
+        phases = [e['phase'] for e in events if e['name'] == 'phase']
+        self.assertTrue('_do_posts' in phases and '_do_index' in phases)
+
+    def test_generate(self):
+        self.check(1)
+
+    def test_generate_jobs(self):
+        self.check(2)
+
+
+class SearchTest(TempDirTestCase):
+    """The search index finds every post by the terms of its title, tags
+    and body, spilled to disk or not"""
+
+    def test_terms(self):
+        self.assertEqual(tokenize(u"The stories of a class, walked quickly"), [u'story', u'class', u'walk', u'quick'])
+        self.assertEqual(post_terms({'metadata': {'title': u'Stories', 'tags': [u'python']}, 'html': u'<p>A <em>story</em></p>'}),
+                         {u'story': search.TITLE_WEIGHT + 1, u'python': search.TITLE_WEIGHT})
+        self.assertEqual(shard_name(u'python', 2), 'py')
+        self.assertEqual(shard_name(u'\xe9t\xe9', 2), '_c3a974')
+
+    def index(self, corpus):
+        index = SearchIndex(tmpdir=self.tmp)
+        for n, words in enumerate(corpus):
+            index.add(["/%d.html" % (n,), "Post %d" % (n,), "2005-01-01T00:00:00"], post_terms({'metadata': {}, 'html': words}))
+        return dict(index.files())
+
+    def test_spill(self):
+        rnd = random.Random(1)
+        words = [u''.join(rnd.choice(u'abcdefgh\xe9') for i in range(5)) for w in range(300)]
+        corpus = [u' '.join(rnd.choice(words) for i in range(40)) for n in range(60)]
+        expected = self.index(corpus)
+        real_max, search.MAX_BUFFERED = search.MAX_BUFFERED, 50
+        try:
+            self.assertEqual(self.index(corpus), expected)
+        finally:
+            search.MAX_BUFFERED = real_max
+        # the spilled postings are removed
+        self.assertEqual(os.listdir(self.tmp), [])
+        docs = json.loads(expected[DOCS_NAME])
+        self.assertEqual(sorted(expected), sorted([DOCS_NAME] + ["%s.json" % (shard,) for shard in docs['shards']]))
+        for n, words in enumerate(corpus):
+            for term in tokenize(words):
+                postings = json.loads(expected["%s.json" % (shard_name(term, 2),)])[term]
+                self.assertTrue(n in postings[::2])
+
+    def test_generate(self):
+        path = os.path.sep.join([self.tmp, 'blog'])
+        generate_corpus(path, posts=6, code_blocks=0, paragraphs=1, statics=0)
+        my_oak = generate(path, GENERATE_SEARCH_INDEX=True)
+        search_path = os.path.sep.join([path, 'site', 'search'])
+        f = open(os.path.sep.join([search_path, DOCS_NAME]))
+        docs = json.load(f)
+        f.close()
+        self.assertEqual(sorted(doc[0] for doc in docs['docs']), sorted(post['url'] for post in my_oak.posts))
+        self.assertEqual(sorted(os.listdir(search_path)),
+                         sorted([DOCS_NAME, 'search.js'] + ["%s.json" % (shard,) for shard in docs['shards']]))
+        for n, doc in enumerate(docs['docs']):
+            for term in tokenize(doc[1]):
+                f = open(os.path.sep.join([search_path, "%s.json" % (shard_name(term, docs['prefix']),)]))
+                self.assertTrue(n in json.load(f)[term][::2])
+                f.close()
+
+
+class ConcurrentTest(TempDirTestCase):
+    """Oak instances generating at once from several threads don't share
+    their caches nor their profilers"""
+
+    def check(self, jobs):
+        oaks = []
+        for n, posts in enumerate([12, 7]):
+            path = os.path.sep.join([self.tmp, "blog%d" % (n,)])
+            generate_corpus(path, posts=posts, tags=4, code_blocks=2, paragraphs=2, statics=0, seed=n)
+            settings = load_settings(path, HTML_CACHE=True, HIGHLIGHT_CACHE=True, JOBS=jobs)
+            # STATIC_PATH is relative to OUTPUT_PATH too, both copy the
+            # empty static directory made below
+            for name in ('CONTENT_PATH', 'OUTPUT_PATH', 'CACHE_PATH'):
+                setattr(settings, name, os.path.sep.join([path, getattr(settings, name)]))
+            my_oak = oak.Oak(logger=logger, settings=settings)
+            my_oak.profiler = Profiler()
+            oaks.append(my_oak)
+        errors = []
+        def run(my_oak):
+            try:
+                my_oak.generate()
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=run, args=(my_oak,)) for my_oak in oaks]
+        os.mkdir(os.path.sep.join([self.tmp, 'static']))
+        cwd = os.getcwd()
+        os.chdir(self.tmp)
+        try:
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(errors, [])
+        for my_oak, posts in zip(oaks, [12, 7]):
+            cache = os.path.sep.join([my_oak.settings.CACHE_PATH, 'html'])
+            self.assertEqual(sum(len(files) for root, dirs, files in os.walk(cache)), posts)
+            cache = os.path.sep.join([my_oak.settings.CACHE_PATH, 'highlight'])
+            self.assertEqual(sum(len(files) for root, dirs, files in os.walk(cache)), posts * 2)
+            self.assertEqual(sorted(my_oak.profiler.posts), sorted(my_oak.sources))
+            # every post, rendered by its own instance, and only those
+            pages = []
+            for root, dirs, files in os.walk(os.path.sep.join([my_oak.settings.OUTPUT_PATH, '2005'])):
+                pages.extend(os.path.join(root, f) for f in files if f != 'index.html')
+            self.assertEqual(sorted(pages), sorted(post['output_path'] for post in my_oak.posts))
+            for post in my_oak.posts:
+                f = open(post['output_path'])
+                self.assertTrue(post['metadata']['title'] in f.read().decode('utf-8'))
+                f.close()
+
+    def test_threads(self):
+        self.check(1)
+
+    def test_threads_jobs(self):
+        self.check(2)
+
+
+class RelatedTest(TempDirTestCase):
+    """Posts get the posts sharing the most tags and title words"""
+
+    def test_common_tags(self):
+        # every tag is shared by about 300 posts, and no title word
+        rnd = random.Random(0)
+        features = [sorted("tag:t%d" % (t,) for t in rnd.sample(range(10), 3)) for i in range(1000)]
+        found = related(features, 5)
+        self.assertEqual([len(pairs) for pairs in found], [5] * len(features))
+        for i, pairs in enumerate(found):
+            for j, score in pairs:
+                self.assertNotEqual(i, j)
+                self.assertTrue(set(features[i]) & set(features[j]))
+
+    @unittest.skipUnless(related_module.numpy is not None, "NumPy and SciPy aren't installed")
+    def test_numpy(self):
+        # the same posts, scores and order of ties, split in blocks or not
+        rnd = random.Random(0)
+        # few distinct posts, so many are tied
+        features = [sorted(set(["tag:t%d" % (t,) for t in rnd.sample(range(8), 2)] +
+                               ["word:w%d" % (rnd.randint(0, 10),)])) for i in range(300)]
+        rows = related_module._weigh(features, related_module.MAX_SHARE)
+        expected = related_module._related_python(rows, 5)
+        self.assertEqual(related_module._related_numpy(rows, 5), expected)
+        real_rows, related_module.BLOCK_ROWS = related_module.BLOCK_ROWS, 7
+        try:
+            self.assertEqual(related_module._related_numpy(rows, 5), expected)
+        finally:
+            related_module.BLOCK_ROWS = real_rows
+        self.assertEqual(related(features, 5), expected)
+
+    def test_too_common(self):
+        # a tag of every post relates none
+        self.assertEqual(related([['tag:a', 'word:%d' % (i,)] for i in range(10)], 5), [[]] * 10)
+
+    def test_headers_read_once(self):
+        path = os.path.sep.join([self.tmp, 'blog'])
+        generate_corpus(path, posts=10, tags=4, paragraphs=1, statics=0)
+        read = []
+        original = Post._read_header
+        def read_header(post):
+            read.append(post._source)
+            return original(post)
+        Post._read_header = read_header
+        try:
+            my_oak = generate(path, RELATED_POSTS=3)
+        finally:
+            Post._read_header = original
+        self.assertEqual(sorted(read), sorted(my_oak.sources))
+        self.assertTrue(all(post['related'] for post in my_oak.posts))
+
+    def test_post_error(self):
+        path = os.path.sep.join([self.tmp, 'blog'])
+        generate_corpus(path, posts=2, statics=0)
+        source = os.path.sep.join(['content', '2005-01-broken.md'])
+        f = open(os.path.sep.join([path, source]), 'w')
+        f.write("---\n  title: 'Broken'\n  tags: ['a'\n---\n\nBody.\n")
+        f.close()
+        try:
+            generate(path, RELATED_POSTS=3)
+        except PostError, e:
+            self.assertEqual(e.source, source)
+            self.assertTrue(str(e).startswith(source + ': '))
+        else:
+            self.fail("PostError not raised")
+
+
+class LayoutTest(TempDirTestCase):
+    """Layouts made from older versions of the bundled ones still work"""
+
+    def layout(self, missing):
+        """Copies the default layout without the `missing` templates
+
+        :returns: the layouts path
+        """
+        layouts = os.path.sep.join([self.tmp, 'layouts'])
+        shutil.copytree(os.path.sep.join([os.path.dirname(oak.__file__), 'layouts', 'default']),
+                        os.path.sep.join([layouts, 'old']))
+        for name in missing:
+            os.remove(os.path.sep.join([layouts, 'old', name]))
+        return layouts
+
+    def test_no_pagination(self):
+        path = os.path.sep.join([self.tmp, 'blog'])
+        generate_corpus(path, posts=6, code_blocks=0, paragraphs=1, statics=0)
+        generate(path, LAYOUTS_PATH=self.layout(['pagination.jinja']), DEFAULT_LAYOUT='old',
+                 TAG_PAGE_SIZE=1, ARCHIVE_PAGE_SIZE=2, INDEX_PAGINATE=True, POSTS_COUNT=2)
+        self.assertTrue(os.path.exists(os.path.sep.join([path, 'site', 'archive', 'page', '3.html'])))
+
+    def test_no_date_archives(self):
+        path = os.path.sep.join([self.tmp, 'blog'])
+        generate_corpus(path, posts=6, code_blocks=0, paragraphs=1, statics=0)
+        my_oak = generate(path, LAYOUTS_PATH=self.layout(['year.jinja', 'month.jinja', 'pagination.jinja']),
+                          DEFAULT_LAYOUT='old')
+        self.assertFalse(my_oak.date_archives)
+        self.assertFalse(os.path.exists(os.path.sep.join([path, 'site', '2005', 'index.html'])))
+        self.assertFalse(os.path.exists(os.path.sep.join([path, 'site', '2005', '01', 'index.html'])))
+        self.assertTrue(os.path.exists(os.path.sep.join([path, 'site', '2005', '01', '2005-01-post-0.html'])))
+        self.assertTrue(os.path.exists(os.path.sep.join([path, 'site', 'archive.html'])))
+
+
+class PrecompressTest(TempDirTestCase):
+    """Compressed siblings never hold outdated contents"""
+
+    def test_precompress(self):
+        for name in ('a.html', 'b.css', 'c.txt'):
+            f = open(os.path.sep.join([self.tmp, name]), 'w')
+            f.write(name * 100)
+            f.close()
+        page = os.path.sep.join([self.tmp, 'a.html'])
+        self.assertEqual(precompress(self.tmp, ('.html', '.css'), jobs=2, use_brotli=False), (2, 0))
+        self.assertEqual(sorted(os.listdir(self.tmp)), ['a.html', 'a.html.gz', 'b.css', 'b.css.gz', 'c.txt'])
+        f = gzip.open(page + '.gz')
+        self.assertEqual(f.read(), 'a.html' * 100)
+        f.close()
+        self.assertEqual(int(os.stat(page + '.gz').st_mtime), int(os.stat(page).st_mtime))
+        # nothing to do for the files not written since
+        self.assertEqual(precompress(self.tmp, ('.html', '.css'), use_brotli=False), (0, 0))
+        os.remove(os.path.sep.join([self.tmp, 'b.css']))
+        self.assertEqual(precompress(self.tmp, ('.html', '.css'), use_brotli=False), (0, 1))
+
+    def test_build_without_precompress(self):
+        path = os.path.sep.join([self.tmp, 'blog'])
+        generate_corpus(path, posts=4, code_blocks=0, paragraphs=1, statics=0)
+        generate(path, INCREMENTAL=True, PRECOMPRESS=True)
+        site = os.path.sep.join([path, 'site'])
+        edited = os.path.sep.join([site, '2005', '01', '2005-01-post-1.html'])
+        untouched = os.path.sep.join([site, '2005', '01', '2005-01-post-2.html'])
+        self.assertTrue(os.path.exists(edited + '.gz'))
+        source = os.path.sep.join([path, 'content', '2005-01-post-1.md'])
+        f = open(source, 'a')
+        f.write("\nOne more line.\n")
+        f.close()
+        generate(path, INCREMENTAL=True)
+        self.assertFalse(os.path.exists(edited + '.gz'))
+        self.assertTrue(os.path.exists(untouched + '.gz'))
+        # and those of removed files go with them
+        os.remove(source)
+        generate(path, INCREMENTAL=True)
+        self.assertFalse(os.path.exists(edited))
+        self.assertEqual([name for name in os.listdir(os.path.dirname(edited)) if name.startswith('2005-01-post-1.')], [])
+
+
+class WriterTest(TempDirTestCase):
+    """A failed write fails the build"""
+
+    def test_close(self):
+        blocked = os.path.sep.join([self.tmp, 'blocked'])
+        os.mkdir(blocked)
+        writer = Writer(queue_size=2, batch_size=1)
+        writer.write(os.path.sep.join([self.tmp, 'a', 'first.html']), 'first')
+        writer.write(blocked, 'not a directory')
+        for n in range(8):
+            # the queue doesn't fill up behind the failed write
+            try:
+                writer.write(os.path.sep.join([self.tmp, 'a', '%d.html' % (n,)]), 'next')
+            except WriteError:
+                break
+        self.assertRaises(WriteError, writer.close)
+        # nor are the files queued after it written
+        self.assertEqual(os.listdir(os.path.sep.join([self.tmp, 'a'])), ['first.html'])
+
+    def test_generate(self):
+        path = os.path.sep.join([self.tmp, 'blog'])
+        generate_corpus(path, posts=4, code_blocks=0, paragraphs=1, statics=0)
+        generate(path, INCREMENTAL=True)
+        page = os.path.sep.join([path, 'site', '2005', '01', '2005-01-post-1.html'])
+        source = os.path.sep.join([path, 'content', '2005-01-post-1.md'])
+        f = open(source, 'a')
+        f.write("\nOne more line.\n")
+        f.close()
+        os.remove(page)
+        os.mkdir(page)
+        try:
+            generate(path, INCREMENTAL=True)
+        except WriteError, e:
+            self.assertEqual(os.path.sep.join([path, e.filename]), page)
+        else:
+            self.fail("The build didn't fail")
+        # the manifest wasn't saved, the page is written by the next build
+        os.rmdir(page)
+        generate(path, INCREMENTAL=True)
+        f = open(page)
+        self.assertTrue("One more line." in f.read())
+        f.close()
+
+
+class ProcessorTest(unittest.TestCase):
+    """The Markdown converter is reused across posts"""
+
+    def setUp(self):
+        # not the relative cache paths of the Oak built last by this thread
+        use_caches()
+
+    def test_reuse(self):
+        bodies = [u"# Title\n\nSome *text*.\n\n[^1]: a note", u"Another [link][a].\n\n[a]: http://example.com",
+                  u"[sourcecode:python]\nprint 1\n[/sourcecode]", u"Plain."]
+        processor = get_processor(MarkdownProcessor)
+        self.assertTrue(processor is get_processor(MarkdownProcessor))
+        converter = processor.converter()
+        # one at a time, with a fresh processor each, or all at once
+        expected = [MarkdownProcessor().process({'raw': raw})['html'] for raw in bodies]
+        self.assertEqual([post['html'] for post in processor.process_many([{'raw': raw} for raw in bodies])], expected)
+        self.assertEqual([processor.process({'raw': raw})['html'] for raw in reversed(bodies)], expected[::-1])
+        self.assertTrue(processor.converter() is converter)
+
+
+if __name__ == '__main__':
+    unittest.main()